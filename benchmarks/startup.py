@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Measures how long ckan_meta_tester takes to get going:
+how long importing it takes, and how long test_metadata takes to reach its first file.
+
+    python benchmarks/startup.py [runs]
+"""
+
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import time, sleep
+from typing import Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Shouldn't be loaded until something needs them
+HEAVY_MODULES = ['git', 'requests', 'netkan', 'configparser', 'yaml']
+
+NETKAN = """spec_version: v1.4
+identifier: Example
+$kref: '#/ckan/github/Example/Example'
+license: MIT
+"""
+
+
+def environment(**extra: str) -> Dict[str, str]:
+    env = {key: val for key, val in os.environ.items()
+           if not key.startswith('INPUT_') and key != 'RUNNER_DEBUG'}
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(REPO_ROOT), env.get('PYTHONPATH')]))
+    env.update(extra)
+    return env
+
+
+def import_seconds() -> float:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ckan_meta_tester'],
+                            capture_output=True, text=True, env=environment(), check=True)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, cumulative, name = line.split('|')
+        if name.strip() == 'ckan_meta_tester':
+            return int(cumulative) / 1000000
+    raise RuntimeError('ckan_meta_tester missing from -X importtime output')
+
+
+def heavy_modules() -> List[str]:
+    result = subprocess.run([sys.executable, '-c',
+                             'import sys, ckan_meta_tester; print(" ".join(sys.modules))'],
+                            capture_output=True, text=True, env=environment(), check=True)
+    loaded = set(result.stdout.split())
+    return [mod for mod in HEAVY_MODULES if mod in loaded]
+
+
+def first_event(path: Path, event: str) -> Optional[Dict[str, float]]:
+    if not path.exists():
+        return None
+    for line in path.read_text().splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # Still being written
+            return None
+        if record.get('event') == event:
+            return record
+    return None
+
+
+def first_file_seconds() -> float:
+    with TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        subprocess.run(['git', 'init', '-q', work], check=True)
+        work.joinpath('NetKAN').mkdir()
+        work.joinpath('NetKAN', 'Example.netkan').write_text(NETKAN)
+        events_path = work / 'events.jsonl'
+        env = environment(INPUT_SOURCE='netkans',
+                          INPUT_EVENT_LOG=str(events_path),
+                          # test_metadata adds a safe.directory, keep it out of the real config
+                          GIT_CONFIG_GLOBAL=str(work / 'gitconfig'))
+        start = time()
+        with subprocess.Popen([sys.executable, '-c',
+                               'import ckan_meta_tester; ckan_meta_tester.test_metadata()'],
+                              cwd=work, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as proc:
+            try:
+                while True:
+                    record = first_event(events_path, 'file_start')
+                    if record is not None:
+                        return record['time'] - start
+                    if proc.poll() is not None:
+                        raise RuntimeError(f'test_metadata exited with {proc.returncode} before testing a file')
+                    sleep(0.001)
+            finally:
+                proc.kill()
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    imports = [import_seconds() for _ in range(runs)]
+    first_files = [first_file_seconds() for _ in range(runs)]
+    print(f'Median of {runs} runs:')
+    print(f'    import ckan_meta_tester: {median(imports) * 1000:7.1f} ms')
+    print(f'    test_metadata first file: {median(first_files) * 1000:6.1f} ms')
+    print(f'    heavy modules loaded by import: {" ".join(heavy_modules()) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
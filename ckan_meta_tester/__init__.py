@@ -1,10 +1,14 @@
 import sys
 import logging
 from os import environ
+from pathlib import Path
+from time import monotonic
 from typing import Optional
 from exitstatus import ExitStatus
 
 from .ckan_meta_tester import CkanMetaTester
+from .event_log import events
+from .supervisor import Supervisor
 
 
 def test_metadata() -> None:
@@ -13,14 +17,51 @@ def test_metadata() -> None:
     if int(environ.get('RUNNER_DEBUG', 0)) == 1:
         log_level = 'debug'
     logging.getLogger('').setLevel(log_level.upper())
+    profile = environ.get('INPUT_PROFILE')
 
     github_token = environ.get('GITHUB_TOKEN')
 
+    timeouts = environ.get('INPUT_TIMEOUTS')
+    if timeouts:
+        Supervisor.configure(timeouts)
+
+    event_log = environ.get('INPUT_EVENT_LOG')
+    if event_log:
+        events.open(Path(event_log))
+    start = monotonic()
+
+    success = False
+    try:
+        if profile:
+            # pstats takes a while to import
+            from .profiler import Profiler  # pylint: disable=import-outside-toplevel
+            with Profiler(Path(profile)):
+                success = run_tester(github_token)
+        else:
+            success = run_tester(github_token)
+    finally:
+        # Even if something blew up, so the stream always ends with the outcome
+        events.emit('run_end', severity='ok' if success else 'error',
+                    duration=round(monotonic() - start, 3))
+        events.close()
+    sys.exit(ExitStatus.success if success else ExitStatus.failure)
+
+
+def run_tester(github_token: Optional[str]) -> bool:
     ex = CkanMetaTester(environ.get('GITHUB_ACTOR') == 'netkan-bot',
-                        environ.get('INPUT_GAME', 'KSP'))
-    sys.exit(ExitStatus.success
-             if ex.test_metadata(environ.get('INPUT_SOURCE', 'netkans'),
-                                 environ.get('INPUT_PULL_REQUEST_URL'),
-                                 github_token,
-                                 environ.get('INPUT_DIFF_META_ROOT'))
-             else ExitStatus.failure)
+                        environ.get('INPUT_GAME', 'KSP'),
+                        int(environ.get('INPUT_SHARD_INDEX') or 0),
+                        int(environ.get('INPUT_SHARD_COUNT') or 1),
+                        environ.get('INPUT_FAIL_FAST', 'false').lower() == 'true',
+                        float(environ.get('INPUT_INSTALL_CACHE_DAYS') or 0),
+                        int(environ.get('INPUT_PREFETCH_CONNECTIONS') or 0),
+                        (int(environ.get('INPUT_REFRESH_COUNT') or 1)
+                         if environ.get('INPUT_INCREMENTAL', 'false').lower() == 'true'
+                         else None),
+                        (Path(environ['INPUT_SHARD_HISTORY'])
+                         if environ.get('INPUT_SHARD_HISTORY') else None))
+    return ex.test_metadata(environ.get('INPUT_SOURCE', 'netkans'),
+                            environ.get('INPUT_PULL_REQUEST_URL'),
+                            github_token,
+                            environ.get('INPUT_DIFF_META_ROOT'),
+                            environ.get('INPUT_MERGE_SHARDS'))
@@ -1,28 +1,44 @@
+from __future__ import annotations
+
 import re
+import json
 from os import environ, makedirs
 from shutil import copy
 import logging
-from subprocess import run, Popen, PIPE, STDOUT
+from subprocess import run
 from pathlib import Path
-from importlib.resources import read_text
 from string import Template
-from typing import Optional, Iterable, Set, List, Any, Tuple, OrderedDict as OD
+from typing import Optional, Iterable, Set, List, Dict, Any, Tuple, OrderedDict as OD, TYPE_CHECKING
 from collections import OrderedDict
+from functools import cached_property, lru_cache
 from tempfile import TemporaryDirectory
 from urllib.parse import urlparse
+from time import monotonic
+from datetime import timedelta
+from hashlib import sha1, sha256
 
-from configparser import ConfigParser
-from git import Repo, DiffIndex
 from exitstatus import ExitStatus
-import requests
-
-from netkan.repos import CkanMetaRepo
 
-from .ckan_install import CkanInstall
 from .game import Game
 from .game_version import GameVersion
 from .dummy_game_instance import DummyGameInstance
+from .duration_history import DurationHistory, lpt_schedule
+from .install_results import InstallResults
+from .incremental_state import IncrementalState
+from .state_file import load_json, save_json
 from .log_group import LogGroup
+from .event_log import events, annotate
+from .spec_validator import SpecValidator
+from .supervisor import Supervisor, CommandTimeout
+
+# These take a while to import and plenty of runs never need them,
+# so they're imported where they're used
+if TYPE_CHECKING:
+    from configparser import ConfigParser
+    from git import Repo, DiffIndex
+    from netkan.repos import CkanMetaRepo
+
+    from .ckan_install import CkanInstall
 
 
 class CkanMetaTester:
@@ -30,35 +46,115 @@ class CkanMetaTester:
 
     INFLATED_PATH = Path('.ckans')
     CACHE_PATH    = Path('.cache')
+    STATE_PATH    = CACHE_PATH / 'meta_tester'
     REPO_PATH     = Path('.repo').resolve()
     TINY_REPO     = REPO_PATH / 'metadata.tar.gz'
 
-    CKAN_INSTALL_TEMPLATE = Template(read_text(
-        'ckan_meta_tester', 'ckan_install_template.txt'))
-    CKAN_INSTALL_IDENTIFIERS_TEMPLATE = Template(read_text(
-        'ckan_meta_tester', 'ckan_install_identifiers_template.txt'))
+    CKAN_INSTALL_TEMPLATE = 'ckan_install_template.txt'
+    CKAN_INSTALL_IDENTIFIERS_TEMPLATE = 'ckan_install_identifiers_template.txt'
 
     PR_BODY_COMPAT_PATTERN = re.compile(r'ckan compat add((?: [0-9.]+)+)')
     PR_BODY_TESTS_PATTERN = re.compile(r'ckan install((?: [A-Za-z][A-Za-z0-9-]*(?:=\S+)?)+)')
 
     GNU_LINE_COL_PATTERN = re.compile(r'^[^:]+:(?P<line>[0-9]+)[:.](?P<col>[0-9]+)')
 
+    GAME_IDS_SEPARATOR_PATTERN = re.compile(r'[\s,]+')
+
     REF_ENV_VARS = [
         'PR_BASE_SHA',
         'EVENT_BEFORE'
     ]
 
-    def __init__(self, i_am_the_bot: bool, game_id: str) -> None:
-        self.source_to_ckans: OD[Path, List[Path]] = OrderedDict()
+    def __init__(self, i_am_the_bot: bool, game_id: str,
+                 shard_index: int = 0, shard_count: int = 1, fail_fast: bool = False,
+                 install_cache_days: float = 0, prefetch_connections: int = 0,
+                 incremental_refresh: Optional[int] = None,
+                 shard_history: Optional[Path] = None) -> None:
+        if shard_count < 1:
+            raise ValueError(f'Shard count must be at least 1, got {shard_count}')
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f'Shard index must be between 0 and {shard_count - 1}, got {shard_index}')
+        if incremental_refresh is not None and shard_count > 1:
+            # Shards never install, so they'd never record a success, and each would
+            # save its own state; every run would test everything without saying so
+            raise ValueError('Incremental runs cannot be sharded')
         self.failed = False
+        # Discovery, spec and lint failures, which apply to every game
+        self.shared_failed = False
+        self.fail_fast = fail_fast
+        self.added_files: Set[Path] = set()
         self.i_am_the_bot = i_am_the_bot
-        self.game = Game.from_id(game_id)
+        # One run can test several games, e.g. 'KSP KSP2'
+        self.games = [Game.from_id(gid)
+                      for gid in self.GAME_IDS_SEPARATOR_PATTERN.split(game_id.strip())]
+        self.use_game(self.games[0])
+        # Set when a game's installs don't happen, so its files aren't proven yet
+        self.installs_skipped = False
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        # Durations that every shard is given, so they can agree on a balanced split
+        self.shard_history = shard_history
+        # What this shard was given out of what, for the merge job to check
+        self.shard_candidates: List[Path] = []
+        self.shard_assigned: List[Path] = []
+        # Generated .ckan, relative to INFLATED_PATH -> the file it came from
+        self.ckan_sources: Dict[str, str] = {}
+        self.durations = DurationHistory(self.STATE_PATH / 'durations.json')
+        self.install_results = InstallResults(self.STATE_PATH / 'installs.json',
+                                              install_cache_days * 24 * 60 * 60)
+        self.prefetch_connections = prefetch_connections
+        self.incremental = (None if incremental_refresh is None
+                            else IncrementalState(self.STATE_PATH / 'incremental.json',
+                                                  incremental_refresh))
+        # Whether each tested file passed everything, for the incremental state
+        self.file_results: Dict[Path, bool] = {}
+        makedirs(self.REPO_PATH, exist_ok=True)
+
+    @cached_property
+    def config(self) -> ConfigParser:
+        from configparser import ConfigParser  # pylint: disable=import-outside-toplevel
         cfg = ConfigParser()
         cfg.read('/usr/local/etc/metadata.ini')
-        self.netkan_cmd = cfg.get('Netkan', 'Command', fallback='mono /usr/local/bin/netkan.exe').split()
-        self.ckan_cmd = cfg.get('Ckan', 'Command', fallback='mono /usr/local/bin/ckan.exe').split()
-        makedirs(self.INFLATED_PATH, exist_ok=True)
-        makedirs(self.REPO_PATH, exist_ok=True)
+        return cfg
+
+    @cached_property
+    def netkan_cmd(self) -> List[str]:
+        return self.config.get('Netkan', 'Command', fallback='mono /usr/local/bin/netkan.exe').split()
+
+    @cached_property
+    def ckan_cmd(self) -> List[str]:
+        return self.config.get('Ckan', 'Command', fallback='mono /usr/local/bin/ckan.exe').split()
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def template(name: str) -> Template:
+        from importlib.resources import read_text  # pylint: disable=import-outside-toplevel
+        return Template(read_text('ckan_meta_tester', name))
+
+    @staticmethod
+    def git_repo(path: Path) -> Repo:
+        from git import Repo  # pylint: disable=import-outside-toplevel
+        return Repo(path)
+
+    def use_game(self, game: Game) -> None:
+        self.game = game
+        if len(self.games) > 1:
+            # Keep each game's generated .ckans and registry apart
+            self.inflated_path = self.INFLATED_PATH / game.short_name
+            self.tiny_repo = self.REPO_PATH / game.short_name / self.TINY_REPO.name
+            self.saved_registry = DummyGameInstance.SAVED_REGISTRY.with_name(
+                f'registry-{game.short_name}.json')
+        else:
+            self.inflated_path = self.INFLATED_PATH
+            self.tiny_repo = self.TINY_REPO
+            self.saved_registry = DummyGameInstance.SAVED_REGISTRY
+        makedirs(self.inflated_path, exist_ok=True)
+        makedirs(self.tiny_repo.parent, exist_ok=True)
+        self.source_to_ckans: OD[Path, List[Path]] = OrderedDict()
+
+    def phase_key(self, phase: str) -> str:
+        # Each game takes its own time, and the estimate adds them all up
+        return phase if len(self.games) == 1 else f'{phase} {self.game.short_name}'
 
     def debug_action(self) -> None:
         if int(environ.get('RUNNER_DEBUG', 0)) == 0:
@@ -66,76 +162,260 @@ class CkanMetaTester:
         working = Path('.')
         logging.debug('Current Working: %s', working.cwd())
         logging.debug('Files: %s', ', '.join([str(x) for x in working.glob('*')]))
-        logging.debug('Repo: %s', Repo('.').git_dir)
+        logging.debug('Repo: %s', self.git_repo(Path('.')).git_dir)
 
-    def test_metadata(self, source: str = 'netkans', pr_body_url: Optional[str] = None, github_token: Optional[str] = None, diff_meta_root: Optional[str] = None) -> bool:
+    def test_metadata(self, source: str = 'netkans', pr_body_url: Optional[str] = None, github_token: Optional[str] = None, diff_meta_root: Optional[str] = None, merge_shards: Optional[str] = None) -> bool:
 
         pr_body = self.get_pr_body(github_token, pr_body_url)
 
         # Work around issue noted in noted in KSP-CKAN/NetKAN#9527
-        Repo('.').git.execute(['git', 'config', '--global', '--add', 'safe.directory', '/github/workspace'])
+        self.git_repo(Path('.')).git.execute(['git', 'config', '--global', '--add', 'safe.directory', '/github/workspace'])
         logging.debug('Starting metadata test')
         self.debug_action()
-        logging.debug('Builds: %s', [str(v) for v in self.game.versions])
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # Only fetch the builds this early if we're going to print them
+            for game in self.games:
+                logging.debug('%s builds: %s', game.short_name, [str(v) for v in game.versions])
 
         # Escape hatch in case author replaces a download after a previous success
         # (which will save it to the persistent cache)
         overwrite_cache = False if pr_body is None else ('#overwrite_cache' in pr_body)
         logging.debug('overwrite_cache: %s', overwrite_cache)
+        if overwrite_cache:
+            # A replaced download can break an install that used to work
+            self.install_results.enabled = False
 
         if not self.CACHE_PATH.exists():
             self.CACHE_PATH.mkdir()
 
         # Action inputs are apparently '' rather than None if not set in the yml
-        meta_repo = CkanMetaRepo(Repo(Path(diff_meta_root))) if diff_meta_root else None
+        meta_repo = None
+        if diff_meta_root:
+            from netkan.repos import CkanMetaRepo  # pylint: disable=import-outside-toplevel
+            meta_repo = CkanMetaRepo(self.git_repo(Path(diff_meta_root)))
+
+        # Finding, checking and linting the files is the same for every game
+        files = [] if merge_shards else self.lint_files(self.files_to_test(source), pr_body)
+        self.shared_failed = self.failed
+
+        for game in self.games:
+            if self.cancelled():
+                self.log_skipped(len(self.games) - self.games.index(game), 'games')
+                break
+            self.use_game(game)
+            if len(self.games) > 1:
+                logging.info('Testing %s', game.short_name)
+            if not self.test_game(files, pr_body, overwrite_cache, github_token, meta_repo, merge_shards):
+                self.failed = True
 
-        for file in self.files_to_test(source):
+        if self.shard_count > 1 and not merge_shards:
+            self.save_shard_manifest()
+        if merge_shards and not self.check_shard_coverage(Path(merge_shards)):
+            self.failed = True
+
+        self.save_incremental(not self.installs_skipped)
+        return not self.failed
+
+    def lint_files(self, files: List[Path], pr_body: Optional[str]) -> List[Path]:
+        files = self.prioritize(files, pr_body)
+        # Weed out simple mistakes before spending time on netkan.exe
+        files = [file for file in files if self.check_spec(file)]
+        self.log_prediction(files)
+        linted = []
+        for num, file in enumerate(files):
+            if self.cancelled():
+                self.log_skipped(len(files) - num, 'files')
+                break
             if pr_body is not None and len(pr_body) < 1:
                 # Warn for empty PR body on every file so it's noticeable in the files changed tab
-                print(f'::warning file={file}::Pull requests should have a description with a summary of the changes')
-            if not self.test_file(file, overwrite_cache, github_token, meta_repo):
-                logging.error('Test of %s failed!', file)
+                annotate('warning', 'Pull requests should have a description with a summary of the changes', file)
+            events.emit('file_start', file=file, phase='lint')
+            start = monotonic()
+            passed = self.lint_file(file)
+            events.emit('file_result', file=file, phase='lint',
+                        severity='ok' if passed else 'error',
+                        duration=round(monotonic() - start, 3))
+            if passed:
+                linted.append(file)
+            else:
+                logging.error('Lint of %s failed!', file)
+                self.file_results[file] = False
                 self.failed = True
-        if self.failed:
+        return linted
+
+    def test_game(self, files: List[Path], pr_body: Optional[str], overwrite_cache: bool,
+                  github_token: Optional[str], meta_repo: Optional[CkanMetaRepo],
+                  merge_shards: Optional[str]) -> bool:
+        # Another game's failures don't stop this one's installs
+        failed = self.shared_failed
+        if merge_shards:
+            self.merge_shards(Path(merge_shards), pr_body)
+        else:
+            for num, file in enumerate(files):
+                if self.cancelled():
+                    self.log_skipped(len(files) - num, 'files')
+                    break
+                start = monotonic()
+                passed = self.test_file(file, overwrite_cache, github_token, meta_repo)
+                events.emit('file_result', file=file, phase='test', game=self.game.short_name,
+                            severity='ok' if passed else 'error',
+                            duration=round(monotonic() - start, 3))
+                self.file_results[file] = self.file_results.get(file, True) and passed
+                if passed:
+                    self.durations.record(self.file_identifier(file), self.phase_key('test'),
+                                          monotonic() - start)
+                else:
+                    logging.error('Test of %s failed!', file)
+                    failed = self.failed = True
+            self.durations.save()
+            self.ckan_sources.update({ckan.relative_to(self.INFLATED_PATH).as_posix(): source.as_posix()
+                                      for source, ckans in self.source_to_ckans.items()
+                                      for ckan in ckans})
+        if failed:
+            self.installs_skipped = True
             return False
 
         if len(self.source_to_ckans) == 0:
             logging.info('No .ckans found, done.')
             return True
 
+        if self.shard_count > 1 and not merge_shards:
+            # Our .ckans may depend on ones inflated by other shards,
+            # so the installs have to wait for the merge pass
+            logging.info('Shard %s of %s done, leaving installs to the merge pass',
+                         self.shard_index + 1, self.shard_count)
+            self.installs_skipped = True
+            return True
+
         # Make secondary repo file with our generated .ckans
-        run(['tar', 'czf', self.TINY_REPO, '-C', self.INFLATED_PATH, '.'],
+        run(['tar', 'czf', self.tiny_repo, '-C', self.inflated_path, '.'],
             check=True)
 
-        for orig_file, files in self.source_to_ckans.items():
-            logging.debug('Installing files for %s: %s', orig_file, files)
-            for file in files:
-                if not self.install_ckan(file, orig_file, pr_body, meta_repo):
-                    logging.error('Install of %s failed!', file)
-                    self.failed = True
+        if self.prefetch_connections > 0:
+            self.prefetch_downloads(self.pr_body_versions(pr_body))
+
+        to_install = [(orig_file, file)
+                      for orig_file, files in self.source_to_ckans.items()
+                      for file in files]
+        for num, (orig_file, file) in enumerate(to_install):
+            if self.cancelled():
+                self.log_skipped(len(to_install) - num, 'installs')
+                break
+            logging.debug('Installing %s for %s', file, orig_file)
+            start = monotonic()
+            passed = self.install_ckan(file, orig_file, pr_body, meta_repo)
+            events.emit('file_result', file=orig_file, ckan=file, phase='install',
+                        game=self.game.short_name, severity='ok' if passed else 'error',
+                        duration=round(monotonic() - start, 3))
+            if not passed:
+                logging.error('Install of %s failed!', file)
+                failed = self.failed = True
+                self.file_results[orig_file] = False
+        self.durations.save()
+        self.install_results.save()
+
+        if not self.install_pr_body_tests(pr_body):
+            failed = self.failed = True
+
+        return not failed
+
+    def install_pr_body_tests(self, pr_body: Optional[str]) -> bool:
+        body_tests = list(self.pr_body_tests(pr_body))
+        if len(body_tests) < 1:
+            return True
+        if self.cancelled():
+            self.log_skipped(len(body_tests), 'installs from the pull request body')
+            return True
+        versions = self.pr_body_versions(pr_body)
+        if len(versions) < 1:
+            annotate('error', 'No game versions specified!', phase='install')
+            return False
 
-        for identifiers in self.pr_body_tests(pr_body):
+        if len(body_tests) > 1:
+            # One instance and one ckan session for every line is much quicker,
+            # and if anything fails we go back to one at a time to find out which
+            start = monotonic()
+            held_annotations: List[Tuple[str, str]] = []
+            if self.install_identifiers(body_tests, versions, held_annotations):
+                duration = round(monotonic() - start, 3)
+                for level, line in held_annotations:
+                    annotate(level, line, phase='install', end='')
+                for identifiers in body_tests:
+                    events.emit('file_result', identifiers=identifiers, phase='install',
+                                game=self.game.short_name, severity='ok',
+                                session_duration=duration)
+                return True
+            logging.info('Combined install failed, trying each line from the pull request body separately')
+
+        passed_all = True
+        for num, identifiers in enumerate(body_tests):
+            if self.cancelled():
+                self.log_skipped(len(body_tests) - num, 'installs from the pull request body')
+                break
             logging.debug('Installing identifiers: %s', ' '.join(identifiers))
-            if not self.install_identifiers(identifiers, pr_body):
+            start = monotonic()
+            passed = self.install_identifiers([identifiers], versions)
+            events.emit('file_result', identifiers=identifiers, phase='install',
+                        game=self.game.short_name, severity='ok' if passed else 'error',
+                        duration=round(monotonic() - start, 3))
+            if not passed:
                 logging.error('Install of %s failed!', ' '.join(identifiers))
-                self.failed = True
+                passed_all = False
+        return passed_all
 
-        return not self.failed
+    def save_incremental(self, installed: bool) -> None:
+        if self.incremental is None:
+            return
+        for file, passed in self.file_results.items():
+            if not passed:
+                # Make sure it's tested again next time
+                self.incremental.forget(file)
+            elif installed:
+                self.incremental.record_success(file)
+        self.incremental.save()
+
+    def check_spec(self, file: Path) -> bool:
+        logging.debug('Checking %s against the spec', file)
+        problems = SpecValidator(file).validate()
+        for problem in problems:
+            annotate('error', problem.message, file, problem.line, phase='spec')
+        if problems:
+            logging.error('Spec check of %s failed!', file)
+            self.failed = True
+            return False
+        return True
 
-    def test_file(self, file: Path, overwrite_cache: bool, github_token: Optional[str] = None, meta_repo: Optional[CkanMetaRepo] = None) -> bool:
-        logging.debug('Attempting jsonlint for %s', file)
+    def cancelled(self) -> bool:
+        return self.fail_fast and self.failed
+
+    @staticmethod
+    def log_skipped(count: int, what: str) -> None:
+        annotate('notice', f'Fail fast mode, skipping {count} remaining {what}')
+
+    def lint_file(self, file: Path) -> bool:
+        logging.debug('Attempting lint for %s', file)
         suffix = file.suffix.lower()
         if suffix == '.netkan':
             if not self.run_for_file(
-                file, ['yamllint', '-f', 'github', '-d', '{extends: relaxed, rules: {colons: disable}}', file]):
+                file, ['yamllint', '-f', 'github', '-d', '{extends: relaxed, rules: {colons: disable}}', file],
+                phase='lint'):
                 logging.debug('yamllint failed for %s', file)
                 return False
-            return self.inflate_file(file, overwrite_cache, github_token, meta_repo)
+            return True
         if suffix == '.ckan':
             if not self.run_for_file(
-                file, ['jsonlint', '-s', '-v', file], full_output_as_error=True, gnu_line_col_fmt=True):
+                file, ['jsonlint', '-s', '-v', file], full_output_as_error=True, gnu_line_col_fmt=True,
+                phase='lint'):
                 logging.debug('jsonlint failed for %s', file)
                 return False
+            return True
+        raise ValueError(f'Cannot test file {file}, must be .netkan or .ckan')
+
+    def test_file(self, file: Path, overwrite_cache: bool, github_token: Optional[str] = None, meta_repo: Optional[CkanMetaRepo] = None) -> bool:
+        suffix = file.suffix.lower()
+        if suffix == '.netkan':
+            return self.inflate_file(file, overwrite_cache, github_token, meta_repo)
+        if suffix == '.ckan':
             return self.validate_file(file, overwrite_cache, github_token)
         raise ValueError(f'Cannot test file {file}, must be .netkan or .ckan')
 
@@ -154,15 +434,16 @@ class CkanMetaTester:
                      *(['--highest-version', str(high_ver)] if high_ver else []),
                      *(['--overwrite-cache'] if overwrite_cache else []),
                      '--outputdir', temppath,
-                     file]):
+                     file],
+                    phase='inflate'):
                     return False
                 ckans = list(temppath.rglob('*.ckan'))
                 for ckan in ckans:
                     print(f'{ckan.name}:')
                     print(ckan.read_text())
-                    logging.debug('Copying %s to %s', ckan, self.INFLATED_PATH)
-                    copy(ckan, self.INFLATED_PATH)
-                self.source_to_ckans[file] = [self.INFLATED_PATH / ckan.name
+                    logging.debug('Copying %s to %s', ckan, self.inflated_path)
+                    copy(ckan, self.inflated_path)
+                self.source_to_ckans[file] = [self.inflated_path / ckan.name
                                               for ckan in ckans]
                 logging.debug('Files generated: %s', self.source_to_ckans[file])
         return True
@@ -177,21 +458,86 @@ class CkanMetaTester:
                  '--cachedir', self.CACHE_PATH,
                  '--net-useragent', self.USER_AGENT,
                  *(['--overwrite-cache'] if overwrite_cache else []),
-                 '--validate-ckan', file]):
+                 '--validate-ckan', file],
+                phase='validate'):
                 return False
-            copy(file, self.INFLATED_PATH)
-            self.source_to_ckans[file] = [self.INFLATED_PATH / file.name]
+            copy(file, self.inflated_path)
+            self.source_to_ckans[file] = [self.inflated_path / file.name]
             return True
 
+    def merge_shards(self, shards_path: Path, pr_body: Optional[str] = None) -> None:
+        logging.debug('Merging .ckans from shards in %s', shards_path)
+        manifests = {path: load_json(path, {}) for path in sorted(shards_path.rglob('shard-*.json'))}
+        # So problems are reported on the files in the repo rather than the artifacts
+        sources = {path.parent / ckan: Path(source)
+                   for path, manifest in manifests.items()
+                   for ckan, source in manifest.get('ckans', {}).items()}
+        merged: Dict[Path, List[Path]] = {}
+        for ckan in sorted(shards_path.rglob('*.ckan')):
+            if len(self.games) > 1 and ckan.parent.name != self.game.short_name:
+                # Another game's namespace
+                continue
+            logging.debug('Copying %s to %s', ckan, self.inflated_path)
+            copy(ckan, self.inflated_path)
+            source = sources.get(ckan) or self.guess_source(ckan)
+            merged.setdefault(source, []).append(self.inflated_path / ckan.name)
+        # Install in the same order as an unsharded run would
+        self.added_files |= {Path(file) for manifest in manifests.values()
+                             for file in manifest.get('added', [])}
+        # Each shard's files, longest first
+        listed = dict.fromkeys(Path(file) for manifest in manifests.values()
+                               for file in manifest.get('files', []))
+        ordered = [*(file for file in listed if file in merged),
+                   *(file for file in merged if file not in listed)]
+        self.source_to_ckans = OrderedDict((file, merged[file])
+                                           for file in self.prioritize(ordered, pr_body))
+        logging.info('Merged %s .ckans from shards', len(self.source_to_ckans))
+
+    @staticmethod
+    def guess_source(ckan: Path) -> Path:
+        # Without a shard manifest, the .netkan named after the identifier is the best bet
+        try:
+            netkan = Path('NetKAN') / f'{json.loads(ckan.read_text())["identifier"]}.netkan'
+        except (ValueError, KeyError):
+            return ckan
+        return netkan if netkan.is_file() else ckan
+
+    def prefetch_downloads(self, pr_body_versions: List[GameVersion]) -> None:
+        # Only needed if there's something to install
+        from .download_cache import DownloadCache  # pylint: disable=import-outside-toplevel
+        from .prefetch import Prefetcher  # pylint: disable=import-outside-toplevel
+        with LogGroup('Prefetching downloads'):
+            # Our own .ckans' downloads are already cached from inflating them,
+            # it's the dependencies that need a real ckan update to find.
+            # The instance is only there for that, so skip the compat adds.
+            try:
+                with DummyGameInstance(Path('/game-instance'), self.ckan_cmd,
+                                       self.tiny_repo, self.game.versions[-1], [],
+                                       self.CACHE_PATH, self.game, None,
+                                       self.saved_registry):
+                    available = [self.saved_registry, *DummyGameInstance.repo_data_files()]
+            except CommandTimeout as exc:
+                logging.warning('Could not set up game instance, skipping prefetch: %s', exc)
+                return
+            cache = DownloadCache(self.CACHE_PATH, self.STATE_PATH, self.USER_AGENT,
+                                  Prefetcher.pooled_session(self.prefetch_connections))
+            failures = Prefetcher(cache, self.prefetch_connections).prefetch(
+                (file for files in self.source_to_ckans.values() for file in files),
+                available, self.game, pr_body_versions)
+            if failures > 0:
+                logging.warning('%s downloads could not be prefetched, installs will retry them', failures)
+
     def install_ckan(self, file: Path, orig_file: Path, pr_body: Optional[str], meta_repo: Optional[CkanMetaRepo]) -> bool:
+        from .ckan_install import CkanInstall  # pylint: disable=import-outside-toplevel
         logging.debug('Trying to install %s', file)
+        start = monotonic()
         ckan = CkanInstall(file)
         if meta_repo is not None:
             diff = ckan.find_diff(meta_repo)
             if diff is not None:
                 if len(diff) == 0:
-                    print(f'::notice file={orig_file}::Diff empty for {ckan.name} {ckan.version}, skipping install',
-                          flush=True)
+                    annotate('notice', f'Diff empty for {ckan.name} {ckan.version}, skipping install',
+                             orig_file, phase='install')
                     return True
                 with LogGroup(f'Diffing {ckan.name} {ckan.version}'):
                     print(diff, end='', flush=True)
@@ -199,38 +545,90 @@ class CkanMetaTester:
             versions = [*self.pr_body_versions(pr_body),
                         *ckan.compat_versions(self.game)]
             if len(versions) < 1:
-                print(f'::error file={orig_file}::{file} is not compatible with any game versions!', flush=True)
+                annotate('error', f'{file} is not compatible with any game versions!', orig_file, phase='install')
                 return False
 
-            with DummyGameInstance(Path('/game-instance'), self.ckan_cmd,
-                                   self.TINY_REPO, versions[-1], versions[:-1],
-                                   self.CACHE_PATH, self.game,
-                                   getattr(ckan, 'release_status', None)):
-
-                return self.run_for_file(
-                    orig_file,
-                    [*self.ckan_cmd, 'prompt', '--headless',
-                     '--net-useragent', self.USER_AGENT],
-                    input_str=self.CKAN_INSTALL_TEMPLATE.substitute(
-                        ckanfile=file, identifier=ckan.identifier))
-
-    def install_identifiers(self, identifiers: List[str], pr_body: Optional[str]) -> bool:
-        logging.debug('Trying to install %s', ' '.join(identifiers))
-        with LogGroup(f'Installing {" ".join(identifiers)}'):
-            versions = self.pr_body_versions(pr_body)
-            if len(versions) < 1:
-                print('::error::No game versions specified!', flush=True)
+            stability = getattr(ckan, 'release_status', None)
+            key = self.install_key(file, versions, stability)
+            if key is not None and self.already_installed(key, orig_file, ckan):
+                return True
+
+            try:
+                with DummyGameInstance(Path('/game-instance'), self.ckan_cmd,
+                                       self.tiny_repo, versions[-1], versions[:-1],
+                                       self.CACHE_PATH, self.game, stability,
+                                       self.saved_registry):
+
+                    if key is None:
+                        # The first instance of the run has just saved the registry
+                        key = self.install_key(file, versions, stability)
+                        if key is not None and self.already_installed(key, orig_file, ckan):
+                            return True
+
+                    if not self.run_for_file(
+                        orig_file,
+                        [*self.ckan_cmd, 'prompt', '--headless',
+                         '--net-useragent', self.USER_AGENT],
+                        input_str=self.template(self.CKAN_INSTALL_TEMPLATE).substitute(
+                            ckanfile=file, identifier=ckan.identifier),
+                        phase='install'):
+                        return False
+            except CommandTimeout as exc:
+                annotate('error', f'Could not set up game instance: {exc}', orig_file, phase='instance')
                 return False
+        if key is not None:
+            self.install_results.record(key)
+        self.durations.record(ckan.identifier, self.phase_key('install'), monotonic() - start)
+        return True
 
-            with DummyGameInstance(
-                Path('/game-instance'), self.ckan_cmd, self.TINY_REPO,
-                versions[-1], versions[:-1], self.CACHE_PATH, self.game, None):
-
-                return self.run_for_file(
-                    None,
-                    [*self.ckan_cmd, 'prompt', '--headless'],
-                    input_str=self.CKAN_INSTALL_IDENTIFIERS_TEMPLATE.substitute(
-                        identifiers=' '.join(identifiers)))
+    def install_key(self, file: Path, versions: List[GameVersion], stability: Optional[str]) -> Optional[str]:
+        if not self.saved_registry.exists():
+            return None
+        return InstallResults.key(file.read_bytes(), [str(v) for v in versions], stability,
+                                  [self.saved_registry.read_bytes(),
+                                   # Other .ckans from this run can be dependencies
+                                   self.tiny_repo_contents(),
+                                   # Newer versions of CKAN keep the available modules here
+                                   *(path.read_bytes() for path in DummyGameInstance.repo_data_files())])
+
+    def tiny_repo_contents(self) -> bytes:
+        # The tarball itself has new timestamps every run, so use what's in it
+        return b'\0'.join(path.name.encode() + b'\0' + path.read_bytes()
+                           for path in sorted(self.inflated_path.glob('*.ckan')))
+
+    def already_installed(self, key: str, orig_file: Path, ckan: CkanInstall) -> bool:
+        if self.install_results.known_good(key):
+            annotate('notice', f'{ckan.name} {ckan.version} was already installed successfully with the same metadata, game versions and registry, skipping install',
+                     orig_file, phase='install')
+            return True
+        return False
+
+    def install_identifiers(self, identifier_sets: List[List[str]], versions: List[GameVersion],
+                            held_annotations: Optional[List[Tuple[str, str]]] = None) -> bool:
+        names = ', '.join(' '.join(identifiers) for identifiers in identifier_sets)
+        logging.debug('Trying to install %s', names)
+        with LogGroup(f'Installing {names}'):
+            try:
+                with DummyGameInstance(
+                    Path('/game-instance'), self.ckan_cmd, self.tiny_repo,
+                    versions[-1], versions[:-1], self.CACHE_PATH, self.game, None,
+                    self.saved_registry):
+
+                    # Each set is removed again before the next one is installed
+                    return self.run_for_file(
+                        None,
+                        [*self.ckan_cmd, 'prompt', '--headless'],
+                        input_str=''.join(
+                            self.template(self.CKAN_INSTALL_IDENTIFIERS_TEMPLATE).substitute(
+                                identifiers=' '.join(identifiers))
+                            for identifiers in identifier_sets),
+                        phase='install', held_annotations=held_annotations)
+            except CommandTimeout as exc:
+                if held_annotations is None:
+                    annotate('error', f'Could not set up game instance: {exc}', phase='instance')
+                else:
+                    logging.warning('Could not set up game instance: %s', exc)
+                return False
 
     @staticmethod
     def get_pr_body(github_token: Optional[str], pr_url: Optional[str]) -> Optional[str]:
@@ -245,6 +643,7 @@ class CkanMetaTester:
                 else:
                     logging.warning('Invalid pull request url, omitting Authorization header')
 
+            import requests  # pylint: disable=import-outside-toplevel
             resp = requests.get(pr_url, headers=headers, timeout=30)
             if resp.ok:
                 # If the PR has an empty body, 'body' is set to None, not the empty string
@@ -269,15 +668,107 @@ class CkanMetaTester:
             for match
             in self.PR_BODY_TESTS_PATTERN.findall(pr_body))
 
-    def files_to_test(self, source: Optional[str]) -> Iterable[Path]:
+    def files_to_test(self, source: Optional[str]) -> List[Path]:
         if not source:
             raise ValueError('Source cannot be None')
         if source == 'netkans':
-            return self.netkans()
+            files = list(self.netkans())
+            if self.incremental is not None:
+                files = self.incremental.select(
+                    files, IncrementalState.builds_hash(
+                        self.game.versions if len(self.games) == 1
+                        else [f'{game.short_name} {ver}'
+                              for game in self.games for ver in game.versions]))
+            return self.shard_files(files)
         if source == 'commits':
-            return self.paths_from_diff(self.branch_diff(Repo('.')))
+            return self.shard_files(self.paths_from_diff(self.branch_diff(self.git_repo(Path('.')))))
         raise ValueError(f'Source {source} is not valid, must be netkans or commits')
 
+    def prioritize(self, files: List[Path], pr_body: Optional[str]) -> List[Path]:
+        # Files the author asked to install come first, then brand new mods, then updates,
+        # so the most likely problems show up soonest; the sort is stable, so each group
+        # stays longest first
+        requested = {identifier.split('=', 1)[0]
+                     for identifiers in self.pr_body_tests(pr_body)
+                     for identifier in identifiers}
+        return sorted(files, key=lambda file: (
+            0 if self.file_identifier(file) in requested
+            else 1 if file in self.added_files
+            else 2))
+
+    @staticmethod
+    def file_identifier(file: Path) -> str:
+        # .ckans live in a folder named after their identifier, .netkans are named after it
+        return file.parent.name if file.suffix.lower() == '.ckan' else file.stem
+
+    def in_shard(self, file: Path) -> bool:
+        # A stable hash of the path, so every matrix node agrees
+        # without talking to each other
+        return (int(sha1(file.as_posix().encode()).hexdigest(), 16) % self.shard_count
+                == self.shard_index)
+
+    def shard_files(self, files: Iterable[Path]) -> List[Path]:
+        self.shard_candidates = list(files)
+        if self.shard_count == 1:
+            assigned = self.shard_candidates
+        elif self.shard_history is None:
+            assigned = [file for file in self.shard_candidates if self.in_shard(file)]
+        else:
+            # Matrix nodes restore their own caches, which can differ, so balancing
+            # is only safe with a history file that every shard is given
+            costs = DurationHistory(self.shard_history).costs(
+                {file: self.file_identifier(file) for file in self.shard_candidates})
+            assigned = lpt_schedule(costs, self.shard_count)[self.shard_index]
+        self.shard_assigned = assigned
+        # Longest first, which is safe to decide from our own history
+        costs = self.durations.costs({file: self.file_identifier(file) for file in assigned})
+        return sorted(assigned, key=lambda file: (-costs[file], file.as_posix()))
+
+    def save_shard_manifest(self) -> None:
+        save_json(self.INFLATED_PATH / f'shard-{self.shard_index}.json', {
+            'index': self.shard_index,
+            'count': self.shard_count,
+            # Shards that disagree about the files can't cover them between them
+            'candidates': sha256('\n'.join(sorted(file.as_posix() for file
+                                                  in self.shard_candidates)).encode()).hexdigest(),
+            'total': len(self.shard_candidates),
+            'files': [file.as_posix() for file in self.shard_assigned],
+            # So the merge job can install new mods first too
+            'added': [file.as_posix() for file in self.shard_assigned if file in self.added_files],
+            'ckans': self.ckan_sources,
+        })
+
+    def check_shard_coverage(self, shards_path: Path) -> bool:
+        manifests = [load_json(path, {}) for path in sorted(shards_path.rglob('shard-*.json'))]
+        if len(manifests) < 1:
+            annotate('error', f'No shard manifests found in {shards_path}, cannot check that every file was tested',
+                     phase='merge')
+            return False
+        problems = []
+        count = manifests[0].get('count', 0)
+        indices = sorted(manifest.get('index') for manifest in manifests)
+        if indices != list(range(count)):
+            problems.append(f'expected shards 0 to {count - 1}, found {indices}')
+        if len({(manifest.get('count'), manifest.get('candidates')) for manifest in manifests}) > 1:
+            problems.append('shards found different files to test')
+        assigned = [file for manifest in manifests for file in manifest.get('files', [])]
+        if len(assigned) != len(set(assigned)):
+            problems.append(f'{len(assigned) - len(set(assigned))} files were tested by more than one shard')
+        total = manifests[0].get('total', 0)
+        if len(set(assigned)) != total:
+            problems.append(f'shards tested {len(set(assigned))} of {total} files')
+        for problem in problems:
+            annotate('error', f'Shards did not cover the files exactly once: {problem}', phase='merge')
+        return len(problems) == 0
+
+    def log_prediction(self, files: List[Path]) -> None:
+        known = [file for file in files
+                 if self.durations.estimate(self.file_identifier(file)) is not None]
+        total = sum(self.durations.costs({file: self.file_identifier(file)
+                                          for file in files}).values())
+        logging.info('Predicted run time for %s files (%s with history): %s',
+                     len(files), len(known), timedelta(seconds=round(total)))
+
     def netkans(self) -> Iterable[Path]:
         logging.debug('Searching repo for netkan files')
         return (f for f in Path().rglob('*')
@@ -316,10 +807,13 @@ class CkanMetaTester:
         if diff:
             logging.debug('Searching diff for changed files')
             all_adds, all_mods = self.filenames_from_diff(diff)
+            self.added_files = {Path(file) for file in all_adds}
             # Existing files probably have valid names, new ones need to be checked
-            for file in all_adds:
-                if not self.check_added_path(Path(file)):
-                    self.failed = True
+            # (by the first shard only, so the same problem isn't reported N times)
+            if self.shard_index == 0:
+                for file in all_adds:
+                    if not self.check_added_path(Path(file)):
+                        self.failed = True
             files = sorted(all_adds | all_mods)
             return (Path(file) for file in files if self.netkan_or_ckan(file))
         return iter([])
@@ -339,80 +833,73 @@ class CkanMetaTester:
     def check_added_path(self, file: Path) -> bool:
         if file.suffix == '.netkan':
             if file.parts[0] != 'NetKAN':
-                print(f'::error file={file}::{file} should be in the NetKAN folder', flush=True)
+                annotate('error', f'{file} should be in the NetKAN folder', file, phase='discover')
                 return False
             frozen=file.with_suffix('.frozen')
             if frozen.exists():
-                print(f'::error file={file}::{file.stem} is frozen, unfreeze it by renaming or deleting {frozen}', flush=True)
+                annotate('error', f'{file.stem} is frozen, unfreeze it by renaming or deleting {frozen}', file, phase='discover')
                 return False
         elif file.suffix == '.ckan':
             if not self.i_am_the_bot:
-                print(f'::warning file={file}::Usually we should trust the bot to create .ckan files, are you sure you know what you\'re doing?')
+                annotate('warning', 'Usually we should trust the bot to create .ckan files, are you sure you know what you\'re doing?', file, phase='discover')
             if len(file.parts) != 2:
-                print(f'::error file={file}::{file} should be placed in the folder named after its mod\'s identifier')
+                annotate('error', f'{file} should be placed in the folder named after its mod\'s identifier', file, phase='discover')
                 return False
         else:
-            print(f'::warning file={file}::To validate {file}, set its extension to .netkan or .ckan', flush=True)
+            annotate('warning', f'To validate {file}, set its extension to .netkan or .ckan', file, phase='discover')
         return True
 
-    def run_for_file(self, file: Optional[Path], cmd: List[Any],
-        input_str: Optional[str] = None, full_output_as_error: Optional[bool] = False, gnu_line_col_fmt: Optional[bool] = False) -> bool:
+    @staticmethod
+    def annotate_or_hold(level: str, line: str, file: Optional[Path], phase: Optional[str],
+                         held_annotations: Optional[List[Tuple[str, str]]]) -> None:
+        if held_annotations is None:
+            annotate(level, line, file, phase=phase, end='')
+        else:
+            print(line, flush=True, end='')
+            held_annotations.append((level, line))
 
-        with Popen(cmd, text=True, universal_newlines=True,
-                   stdin=(PIPE if input_str else None), stdout=PIPE, stderr=STDOUT
-             ) as cmd_pipe:
+    def run_for_file(self, file: Optional[Path], cmd: List[Any],
+        input_str: Optional[str] = None, full_output_as_error: Optional[bool] = False, gnu_line_col_fmt: Optional[bool] = False,
+        phase: Optional[str] = None, held_annotations: Optional[List[Tuple[str, str]]] = None) -> bool:
+        # For runs that will be retried if they fail, held_annotations collects the errors
+        # and warnings to annotate if they succeed, since a failure is reported by the retry
+        report = held_annotations is None
 
-            if cmd_pipe is None:
-                return False
-            if cmd_pipe.stdout is None:
-                return False
-            if input_str:
-                if cmd_pipe.stdin is None:
-                    return False
-                cmd_pipe.stdin.write(input_str)
-                cmd_pipe.stdin.flush()
-                cmd_pipe.stdin.close()
+        with Supervisor(cmd, phase, input_str) as sup:
             full_output = ''
-            for line in iter(cmd_pipe.stdout.readline, ''):
+            for line in sup.lines():
                 if full_output_as_error:
                     full_output += line
                 elif ' ERROR ' in line or ' FATAL ' in line:
-                    if file:
-                        print(f'::error file={file}::{line}', flush=True, end='')
-                    else:
-                        print(f'::error::{line}', flush=True, end='')
+                    self.annotate_or_hold('error', line, file, phase, held_annotations)
                 elif ' WARN ' in line:
-                    if file:
-                        print(f'::warning file={file}::{line}', flush=True, end='')
-                    else:
-                        print(f'::warning::{line}', flush=True, end='')
+                    self.annotate_or_hold('warning', line, file, phase, held_annotations)
                 else:
                     print(line, flush=True, end='')
-            if cmd_pipe.wait() != ExitStatus.success:
+            exit_code = sup.wait()
+            # The command line isn't recorded because it can contain the GitHub token
+            events.emit('command', file=file, phase=phase, command=sup.name,
+                        exit_code=exit_code, duration=round(sup.duration, 3),
+                        cpu=None if sup.cpu_seconds is None else round(sup.cpu_seconds, 3),
+                        max_rss_kb=sup.peak_rss_kb, timed_out=sup.timed_out)
+            if sup.timed_out:
+                if report:
+                    annotate('error', f'{sup.name} {sup.timed_out} and was killed', file, phase=phase)
+                else:
+                    logging.warning('%s %s and was killed', sup.name, sup.timed_out)
+                return False
+            if exit_code != ExitStatus.success:
                 if full_output_as_error:
                     # This is the crazy method for putting newlines into ::error
                     full_output = full_output.rstrip().replace('\n', '%0A')
-                    if gnu_line_col_fmt:
-                        # Get the line and column from the start of the output in GNU format
-                        # https://www.gnu.org/prep/standards/html_node/Errors.html
-                        match = self.GNU_LINE_COL_PATTERN.match(full_output)
-                        if match:
-                            line_num = match.group('line')
-                            col_num = match.group('col')
-                            if file:
-                                print(f'::error file={file},line={line_num},col={col_num}::{full_output}', flush=True)
-                            else:
-                                print(f'::error::{full_output}', flush=True)
-                        else:
-                            if file:
-                                print(f'::error file={file}::{full_output}', flush=True)
-                            else:
-                                print(f'::error::{full_output}', flush=True)
-                    else:
-                        if file:
-                            print(f'::error file={file}::{full_output}', flush=True)
-                        else:
-                            print(f'::error::{full_output}', flush=True)
+                    # Get the line and column from the start of the output in GNU format
+                    # https://www.gnu.org/prep/standards/html_node/Errors.html
+                    match = (self.GNU_LINE_COL_PATTERN.match(full_output)
+                             if gnu_line_col_fmt and file else None)
+                    annotate('error', full_output, file,
+                             match.group('line') if match else None,
+                             match.group('col') if match else None,
+                             phase=phase)
                 return False
             if full_output_as_error:
                 print(full_output.rstrip(), flush=True)
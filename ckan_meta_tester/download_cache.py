@@ -0,0 +1,140 @@
+import logging
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_UN
+from hashlib import sha1, sha256
+from os import getpid
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse, unquote
+
+import requests
+
+from .state_file import load_json, save_json
+
+
+class DownloadCache:
+    """Lets several workers share the download cache used by netkan.exe and ckan.exe
+    without fetching the same URL twice or reading a half written file"""
+
+    CHUNK_SIZE = 1024 * 1024
+    # Lock files are kept in the persistent cache, so URLs share a fixed number of them
+    # rather than adding one per URL every run; unlinking them would race with waiters
+    LOCK_PREFIX_LENGTH = 2
+
+    def __init__(self, cache_path: Path, state_path: Path, user_agent: str,
+                 session: Optional[requests.Session] = None) -> None:
+        self.cache_path = cache_path
+        self.locks_path = state_path / 'locks'
+        # Same file system as the cache, so renaming into place is atomic
+        self.partial_path = state_path / 'downloading'
+        self.manifest_path = state_path / 'downloads.json'
+        self.user_agent = user_agent
+        self.session = session or requests.Session()
+
+    @staticmethod
+    def url_hash(url: str) -> str:
+        # CKAN finds cached files by this prefix, see NetFileCache.CreateURLHash
+        return sha1(url.encode()).hexdigest()[:8].upper()
+
+    @classmethod
+    def cache_filename(cls, url: str, description: Optional[str] = None) -> str:
+        name = description or unquote(Path(urlparse(url).path).name) or 'download'
+        return f'{cls.url_hash(url)}-{name.replace("/", "-")}'
+
+    def cached(self, url: str) -> Optional[Path]:
+        entry = self.manifest().get(url)
+        if entry is not None:
+            path = self.cache_path / entry['file']
+            if path.is_file():
+                return path
+        # Possibly saved by netkan.exe or ckan.exe rather than us
+        return next(iter(sorted(self.cache_path.glob(f'{self.url_hash(url)}-*'))), None)
+
+    def manifest(self) -> Dict[str, Dict[str, str]]:
+        return load_json(self.manifest_path, {})
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        self.locks_path.mkdir(parents=True, exist_ok=True)
+        with open(self.locks_path / f'{name}.lock', 'w', encoding='utf-8') as lock_file:
+            flock(lock_file, LOCK_EX)
+            try:
+                yield
+            finally:
+                flock(lock_file, LOCK_UN)
+
+    def fetch(self, url: str, description: Optional[str] = None,
+              sha256_hash: Optional[str] = None, sha1_hash: Optional[str] = None) -> Path:
+        """Return the cached file for url, downloading it first if nobody has yet
+        or if the cached file doesn't match the expected hashes.
+        Raises requests.RequestException if the download fails
+        and ValueError if it doesn't match the expected hashes."""
+        found = self.cached(url)
+        if found is not None and self.matches(url, found, sha256_hash, sha1_hash):
+            logging.debug('Found %s in cache at %s', url, found)
+            return found
+        # Holding the URL's lock is our reservation; anyone else fetching it
+        # waits here and then finds our finished file
+        with self.lock(self.url_hash(url)[:self.LOCK_PREFIX_LENGTH]):
+            found = self.cached(url)
+            if found is not None:
+                if self.matches(url, found, sha256_hash, sha1_hash):
+                    logging.debug('%s was downloaded by another worker to %s', url, found)
+                    return found
+                # The author may have replaced the download
+                logging.warning('Cached %s does not match the expected hashes, downloading again', found)
+            return self.download(url, self.cache_filename(url, description),
+                                 sha256_hash, sha1_hash)
+
+    def matches(self, url: str, path: Path,
+                sha256_hash: Optional[str], sha1_hash: Optional[str]) -> bool:
+        if not sha256_hash and not sha1_hash:
+            return True
+        entry = self.manifest().get(url, {})
+        if sha256_hash and entry.get('file') == path.name:
+            # Both hashes were checked when we downloaded it
+            return entry.get('sha256') == sha256_hash.upper()
+        # Saved by netkan.exe or ckan.exe, so we have to look
+        sha256_hasher = sha256()
+        sha1_hasher = sha1()
+        with open(path, 'rb') as cached_file:
+            for chunk in iter(lambda: cached_file.read(self.CHUNK_SIZE), b''):
+                sha256_hasher.update(chunk)
+                sha1_hasher.update(chunk)
+        return all(not expected or expected.upper() == hasher.hexdigest().upper()
+                   for expected, hasher in ((sha256_hash, sha256_hasher), (sha1_hash, sha1_hasher)))
+
+    def download(self, url: str, filename: str,
+                 sha256_hash: Optional[str], sha1_hash: Optional[str]) -> Path:
+        logging.debug('Downloading %s', url)
+        self.partial_path.mkdir(parents=True, exist_ok=True)
+        partial = self.partial_path / f'{filename}.{getpid()}'
+        sha256_hasher = sha256()
+        sha1_hasher = sha1()
+        try:
+            with self.session.get(url, headers={'User-Agent': self.user_agent},
+                                  stream=True, timeout=30) as resp:
+                resp.raise_for_status()
+                with open(partial, 'wb') as partial_file:
+                    for chunk in resp.iter_content(self.CHUNK_SIZE):
+                        partial_file.write(chunk)
+                        sha256_hasher.update(chunk)
+                        sha1_hasher.update(chunk)
+            for expected, hasher in ((sha256_hash, sha256_hasher), (sha1_hash, sha1_hasher)):
+                if expected and expected.upper() != hasher.hexdigest().upper():
+                    raise ValueError(f'Download from {url} has {hasher.name} {hasher.hexdigest().upper()}, expected {expected.upper()}')
+            final = self.cache_path / filename
+            partial.replace(final)
+        finally:
+            partial.unlink(missing_ok=True)
+        self.publish(url, final, sha256_hasher.hexdigest().upper())
+        logging.debug('Saved %s to %s', url, final)
+        return final
+
+    def publish(self, url: str, path: Path, sha256_hash: str) -> None:
+        with self.lock('manifest'):
+            manifest = self.manifest()
+            manifest[url] = {'file': path.name,
+                             'size': str(path.stat().st_size),
+                             'sha256': sha256_hash}
+            save_json(self.manifest_path, manifest)
@@ -1,12 +1,13 @@
 import logging
+from os import environ
 from pathlib import Path
 from shutil import rmtree, copy, disk_usage
-from subprocess import run
 from types import TracebackType
 from typing import Type, List, Optional
 
 from .game import Game
 from .game_version import GameVersion
+from .supervisor import run, CommandTimeout
 
 
 class DummyGameInstance:
@@ -14,7 +15,8 @@ class DummyGameInstance:
 
     def __init__(self, where: Path, ckan_cmd: List[str], addl_repo: Path,
                  main_ver: GameVersion, other_versions: List[GameVersion],
-                 cache_path: Path, game: Game, stability_tolerance: Optional[str]) -> None:
+                 cache_path: Path, game: Game, stability_tolerance: Optional[str],
+                 saved_registry: Optional[Path] = None) -> None:
         self.where = where
         self.registry_path = self.where / 'CKAN' / 'registry.json'
         self.ckan_cmd = ckan_cmd
@@ -24,12 +26,31 @@ class DummyGameInstance:
         self.cache_path = cache_path
         self.game = game
         self.stability_tolerance = stability_tolerance
+        # Each game needs its own, since their repos differ
+        self.saved_registry = saved_registry or self.SAVED_REGISTRY
         # Hide ckan.exe output unless debugging is enabled
         self.capture = not logging.getLogger().isEnabledFor(logging.DEBUG)
 
+    @staticmethod
+    def repo_data_files() -> List[Path]:
+        # Where ckan.exe keeps each repo's available modules after an update,
+        # see RepositoryDataManager; ApplicationData is the XDG config folder on Linux
+        config = Path(environ.get('XDG_CONFIG_HOME') or Path.home() / '.config')
+        return sorted((config / 'CKAN' / 'repos').glob('*.json'))
+
     def __enter__(self) -> 'DummyGameInstance':
         logging.info('Creating dummy game instance at %s', self.where)
         self.where.mkdir()
+        try:
+            self.populate()
+        except CommandTimeout:
+            # __exit__ isn't called if __enter__ raises
+            self.remove()
+            raise
+        logging.debug('Dummy instance is ready')
+        return self
+
+    def populate(self) -> None:
         logging.debug('Populating fake instance contents')
         run([*self.ckan_cmd,
              'instance', 'fake',
@@ -62,23 +83,28 @@ class DummyGameInstance:
         if self.stability_tolerance in ('testing', 'development'):
             run([*self.ckan_cmd, 'stability', 'set', self.stability_tolerance],
                 capture_output=self.capture, check=False)
-        if self.SAVED_REGISTRY.exists():
-            logging.debug('Restoring saved registry from %s', self.SAVED_REGISTRY)
-            copy(self.SAVED_REGISTRY, self.registry_path)
+        if self.saved_registry.exists():
+            logging.debug('Restoring saved registry from %s', self.saved_registry)
+            copy(self.saved_registry, self.registry_path)
         else:
             logging.debug('Updating registry')
             run([*self.ckan_cmd, 'update'],
                 capture_output=self.capture, check=False)
-            copy(self.registry_path, self.SAVED_REGISTRY)
-            logging.debug('Saving registry to %s', self.SAVED_REGISTRY)
-        logging.debug('Dummy instance is ready')
-        return self
+            copy(self.registry_path, self.saved_registry)
+            logging.debug('Saving registry to %s', self.saved_registry)
 
     def __exit__(self, exc_type: Type[BaseException],
                  exc_value: BaseException, traceback: TracebackType) -> None:
+        self.remove()
+
+    def remove(self) -> None:
         logging.debug('Removing instance from CKAN instance list')
-        run([*self.ckan_cmd, 'instance', 'forget', 'dummy'],
-            capture_output=self.capture, check=False)
+        try:
+            run([*self.ckan_cmd, 'instance', 'forget', 'dummy'],
+                capture_output=self.capture, check=False)
+        except CommandTimeout as exc:
+            # Still delete the files so the next instance can be created
+            logging.error('%s', exc)
         logging.debug('Deleting instance contents')
         rmtree(self.where)
         logging.info('Dummy game instance deleted')
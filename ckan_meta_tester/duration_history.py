@@ -0,0 +1,65 @@
+import logging
+from pathlib import Path
+from statistics import median
+from typing import Dict, List, Optional, Tuple, TypeVar, Hashable
+
+from .state_file import load_json, save_json
+
+T = TypeVar('T', bound=Hashable)
+
+
+class DurationHistory:
+    """Seconds each phase took per identifier in previous runs"""
+
+    DEFAULT_SECONDS = 60.0
+    # Weight of the newest sample, older ones decay geometrically
+    SMOOTHING = 0.5
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.durations: Dict[str, Dict[str, float]] = load_json(self.path, {})
+        logging.debug('Loaded durations for %s identifiers', len(self.durations))
+
+    def record(self, identifier: str, phase: str, seconds: float) -> None:
+        phases = self.durations.setdefault(identifier, {})
+        prev = phases.get(phase)
+        phases[phase] = (seconds if prev is None
+                         else self.SMOOTHING * seconds + (1 - self.SMOOTHING) * prev)
+
+    def estimate(self, identifier: str) -> Optional[float]:
+        phases = self.durations.get(identifier)
+        return sum(phases.values()) if phases else None
+
+    def default_cost(self) -> float:
+        known = [sum(phases.values()) for phases in self.durations.values() if phases]
+        return median(known) if known else self.DEFAULT_SECONDS
+
+    def costs(self, items: Dict[T, str]) -> Dict[T, float]:
+        """Map each item to the predicted seconds for its identifier"""
+        default = self.default_cost()
+        costs: Dict[T, float] = {}
+        for item, identifier in items.items():
+            est = self.estimate(identifier)
+            costs[item] = default if est is None else est
+        return costs
+
+    def save(self) -> None:
+        save_json(self.path, self.durations)
+        logging.debug('Saved durations for %s identifiers to %s',
+                      len(self.durations), self.path)
+
+
+def lpt_schedule(costs: Dict[T, float], workers: int) -> List[List[T]]:
+    """Longest processing time first: hand each item, biggest first,
+    to whichever worker has the least work so far.
+    Ties are broken by the items' sort order so every caller gets the same answer.
+    Each worker's list comes out longest first."""
+    schedule: List[List[T]] = [[] for _ in range(workers)]
+    loads = [0.0] * workers
+    ordered: List[Tuple[float, T]] = sorted(((cost, item) for item, cost in costs.items()),
+                                            key=lambda pair: (-pair[0], str(pair[1])))
+    for cost, item in ordered:
+        worker = loads.index(min(loads))
+        schedule[worker].append(item)
+        loads[worker] += cost
+    return schedule
@@ -0,0 +1,54 @@
+import json
+import logging
+from pathlib import Path
+from time import time
+from typing import Any, Optional, TextIO
+
+
+class EventLog:
+    """Machine readable copy of what we report, one JSON object per line"""
+
+    def __init__(self) -> None:
+        self.stream: Optional[TextIO] = None
+
+    def open(self, path: Path) -> None:
+        logging.debug('Writing events to %s', path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Line buffered, so the file can be tailed while we run
+        self.stream = open(path, 'a', buffering=1, encoding='utf-8')  # pylint: disable=consider-using-with
+
+    def close(self) -> None:
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def emit(self, event: str, **fields: Any) -> None:
+        if self.stream is None:
+            return
+        record = {'time': round(time(), 3), 'event': event}
+        record.update({key: str(val) if isinstance(val, Path) else val
+                       for key, val in fields.items()
+                       if val is not None})
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+
+# Shared by everything that reports, like logging's root logger
+events = EventLog()
+
+
+def annotate(severity: str, message: str, file: Optional[Path] = None,
+             line: Optional[Any] = None, col: Optional[Any] = None,
+             phase: Optional[str] = None, end: str = '\n') -> None:
+    """Print a GitHub workflow command like ::error file=...::message
+    and record the same thing as an event"""
+    location = ','.join(f'{key}={val}'
+                        for key, val in (('file', file), ('line', line), ('col', col))
+                        if val is not None)
+    print(f'::{severity} {location}::{message}' if location else f'::{severity}::{message}',
+          flush=True, end=end)
+    events.emit('annotation', severity=severity, file=file, phase=phase,
+                line=None if line is None else int(line),
+                col=None if col is None else int(col),
+                # Undo the escaping that puts newlines into workflow commands
+                message=message.rstrip().replace('%0A', '\n'))
@@ -1,6 +1,6 @@
 import re
-import requests
 from collections import OrderedDict
+from functools import cached_property
 from typing import List, Dict, Optional, cast
 
 from .game_version import GameVersion
@@ -8,8 +8,11 @@ from .game_version import GameVersion
 class Game:
     BUILDS_URL = ''
 
-    def __init__(self) -> None:
-        self.versions = self._versions_from_json(
+    @cached_property
+    def versions(self) -> List[GameVersion]:
+        # Fetched on first use, since linting doesn't need them
+        import requests  # pylint: disable=import-outside-toplevel
+        return self._versions_from_json(
             requests.get(self.BUILDS_URL).json())
 
     @property
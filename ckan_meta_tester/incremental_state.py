@@ -0,0 +1,59 @@
+import logging
+from hashlib import sha256
+from pathlib import Path
+from time import time
+from typing import Any, Dict, Iterable, List
+
+from .state_file import load_json, save_json
+
+
+class IncrementalState:
+    """Remembers which files passed with which contents, so unchanged ones can be skipped"""
+
+    def __init__(self, path: Path, refresh_count: int) -> None:
+        self.path = path
+        self.refresh_count = refresh_count
+        state: Dict[str, Any] = load_json(self.path, {})
+        self.builds: str = state.get('builds', '')
+        # Path -> {'hash': contents hash, 'success': time of last success}
+        self.files: Dict[str, Dict[str, Any]] = state.get('files', {})
+
+    @staticmethod
+    def file_hash(file: Path) -> str:
+        return sha256(file.read_bytes()).hexdigest()
+
+    @staticmethod
+    def builds_hash(versions: Iterable[Any]) -> str:
+        return sha256(' '.join(str(v) for v in versions).encode()).hexdigest()
+
+    def select(self, files: List[Path], builds: str) -> List[Path]:
+        if builds != self.builds:
+            logging.info('Game versions changed, testing all %s files', len(files))
+            # Results for other versions don't count anymore
+            self.files = {}
+            self.builds = builds
+            return files
+        changed = {file for file in files
+                   if self.files.get(file.as_posix(), {}).get('hash') != self.file_hash(file)}
+        unchanged = [file for file in files if file not in changed]
+        # The least recently proven ones are the most likely to have broken upstream
+        refresh = set(sorted(unchanged,
+                             key=lambda file: (self.files[file.as_posix()].get('success', 0),
+                                               file.as_posix()))
+                      [:self.refresh_count])
+        logging.info('Testing %s changed files and refreshing %s of %s unchanged ones',
+                     len(changed), len(refresh), len(unchanged))
+        return [file for file in files if file in changed or file in refresh]
+
+    def record_success(self, file: Path) -> None:
+        self.files[file.as_posix()] = {'hash': self.file_hash(file), 'success': time()}
+
+    def forget(self, file: Path) -> None:
+        self.files.pop(file.as_posix(), None)
+
+    def save(self) -> None:
+        # Don't keep files that have been deleted
+        self.files = {name: entry for name, entry in self.files.items()
+                      if Path(name).is_file()}
+        save_json(self.path, {'builds': self.builds, 'files': self.files})
+        logging.debug('Saved incremental state for %s files to %s', len(self.files), self.path)
@@ -0,0 +1,49 @@
+import logging
+from hashlib import sha256
+from pathlib import Path
+from time import time
+from typing import Dict, Iterable, List, Optional
+
+from .state_file import load_json, save_json
+
+
+class InstallResults:
+    """Installs that succeeded in previous runs, so identical ones can be skipped"""
+
+    def __init__(self, path: Path, ttl_seconds: float) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.enabled = ttl_seconds > 0
+        now = time()
+        # Expired entries are dropped here so they don't pile up in the cache
+        self.successes: Dict[str, float] = {
+            key: when
+            for key, when in load_json(self.path, {}).items()
+            if now - when < self.ttl_seconds}
+        logging.debug('Loaded %s previous install results', len(self.successes))
+
+    @staticmethod
+    def key(ckan_contents: bytes, versions: List[str],
+            stability: Optional[str], available_contents: Iterable[bytes]) -> str:
+        """available_contents is everything the dependencies could come from"""
+        hasher = sha256()
+        for part in (sha256(ckan_contents).hexdigest(),
+                     # The last one is the instance's own version, which also sets its DLC,
+                     # the order of the others doesn't matter
+                     versions[-1] if versions else '',
+                     ' '.join(sorted(versions[:-1])),
+                     stability or 'stable',
+                     *(sha256(contents).hexdigest() for contents in available_contents)):
+            hasher.update(part.encode())
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def known_good(self, key: str) -> bool:
+        return self.enabled and key in self.successes
+
+    def record(self, key: str) -> None:
+        self.successes[key] = time()
+
+    def save(self) -> None:
+        save_json(self.path, self.successes)
+        logging.debug('Saved %s install results to %s', len(self.successes), self.path)
@@ -1,6 +1,9 @@
+from time import monotonic
 from types import TracebackType
 from typing import Type
 
+from .event_log import events
+
 
 class LogGroup:
 
@@ -8,6 +11,8 @@ class LogGroup:
         self.title = title
         # Inner messages can sneak in front of us if we do this in __enter__
         print(f'::group::{self.title}', flush=True)
+        events.emit('group_start', title=self.title)
+        self.start = monotonic()
 
     def __enter__(self) -> 'LogGroup':
         return self
@@ -15,3 +20,5 @@ class LogGroup:
     def __exit__(self, exc_type: Type[BaseException],
                  exc_value: BaseException, traceback: TracebackType) -> None:
         print('::endgroup::', flush=True)
+        events.emit('group_end', title=self.title,
+                    duration=round(monotonic() - self.start, 3))
@@ -0,0 +1,148 @@
+import re
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+import requests
+
+from .ckan_install import CkanInstall
+from .download_cache import DownloadCache
+from .game import Game
+from .game_version import GameVersion
+from .spec_validator import SpecValidator
+
+
+class Download(NamedTuple):
+    urls: List[str]
+    description: str
+    sha256: Optional[str]
+    sha1: Optional[str]
+
+
+class Prefetcher:
+    """Downloads everything the installs will need ahead of time, several at once,
+    so ckan.exe finds it all in the cache"""
+
+    VERSION_PIECES_PATTERN = re.compile(r'\d+|[^\d.]+')
+
+    @staticmethod
+    def pooled_session(connections: int) -> requests.Session:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=connections,
+                                                pool_maxsize=connections)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def __init__(self, cache: DownloadCache, connections: int) -> None:
+        self.cache = cache
+        self.connections = connections
+        self.available: Dict[str, List[Dict[str, Any]]] = {}
+
+    def add_ckans(self, ckans: Iterable[Path]) -> List[Dict[str, Any]]:
+        modules = [json.loads(ckan.read_text()) for ckan in ckans]
+        for module in modules:
+            self.available.setdefault(module['identifier'], []).append(module)
+        return modules
+
+    def add_available(self, path: Path) -> None:
+        # Older registries carry every available module, newer versions of CKAN
+        # keep them in the repo data files instead, in the same format
+        available = json.loads(path.read_text()).get('available_modules', {})
+        for identifier, avail in available.items():
+            self.available.setdefault(identifier, []).extend(
+                avail.get('module_version', {}).values())
+        logging.debug('Loaded %s available modules from %s', len(available), path)
+
+    def latest(self, identifier: str, versions: List[GameVersion]) -> Optional[Dict[str, Any]]:
+        # Close enough to CKAN's version ordering to guess what it will pick;
+        # a wrong guess only costs an unused download
+        return max((module for module in self.available.get(identifier, [])
+                    if self.compatible(module, versions)),
+                   key=lambda module: self.version_key(module.get('version', '')),
+                   default=None)
+
+    @staticmethod
+    def compatible(module: Dict[str, Any], versions: List[GameVersion]) -> bool:
+        # Same fallbacks as CkanInstall.lowest_compat and highest_compat
+        try:
+            minv = GameVersion(module.get('ksp_version_min', module.get('ksp_version', 'any')))
+            maxv = GameVersion(module.get('ksp_version_max', module.get('ksp_version', 'any')))
+        except TypeError:
+            # Not ours to judge, let ckan.exe decide
+            return True
+        return any(version.compatible(minv, maxv) for version in versions)
+
+    @classmethod
+    def version_key(cls, version: str) -> List[Any]:
+        epoch, _, rest = version.rpartition(':')
+        return [int(epoch) if epoch.isdigit() else 0,
+                *((0, int(piece)) if piece.isdigit() else (1, piece)
+                  for piece in cls.VERSION_PIECES_PATTERN.findall(rest))]
+
+    def with_dependencies(self, modules: List[Dict[str, Any]],
+                          versions: List[GameVersion]) -> List[Dict[str, Any]]:
+        seen: Set[str] = set()
+        result: List[Dict[str, Any]] = []
+        todo = list(modules)
+        while todo:
+            module = todo.pop(0)
+            key = f'{module.get("identifier")} {module.get("version")}'
+            if key in seen:
+                continue
+            seen.add(key)
+            result.append(module)
+            for rel in module.get('depends', []):
+                # any_of could go several ways, leave it to ckan.exe
+                dep = self.latest(rel['name'], versions) if 'name' in rel else None
+                if dep is not None:
+                    todo.append(dep)
+        return result
+
+    @classmethod
+    def downloads(cls, modules: Iterable[Dict[str, Any]]) -> List[Download]:
+        found: Dict[str, Download] = {}
+        for module in modules:
+            if module.get('kind') in SpecValidator.NO_DOWNLOAD_KINDS or 'download' not in module:
+                continue
+            urls = module['download'] if isinstance(module['download'], list) else [module['download']]
+            hashes = module.get('download_hash', {})
+            found.setdefault(urls[0], Download(
+                urls,
+                # Same as CKAN's CkanModule.StandardName
+                f'{module["identifier"]}-{module["version"]}.zip'.replace(':', '-'),
+                hashes.get('sha256'), hashes.get('sha1')))
+        return list(found.values())
+
+    def fetch(self, download: Download) -> bool:
+        for url in download.urls:
+            try:
+                self.cache.fetch(url, download.description, download.sha256, download.sha1)
+                return True
+            except (requests.RequestException, ValueError) as exc:
+                logging.warning('Failed to prefetch %s: %s', url, exc)
+        return False
+
+    def prefetch(self, ckans: Iterable[Path], available: Iterable[Path],
+                 game: Game, extra_versions: List[GameVersion]) -> int:
+        """Returns how many downloads failed; the installs will try those again
+        and report any problems properly"""
+        for path in available:
+            if path.exists():
+                self.add_available(path)
+        ckans = list(ckans)
+        modules = self.add_ckans(ckans)
+        # Each .ckan is installed into an instance compatible with its own game versions,
+        # so its dependencies are whatever ckan.exe finds compatible there
+        downloads = self.downloads(
+            dep
+            for ckan, module in zip(ckans, modules)
+            for dep in self.with_dependencies(
+                [module], [*extra_versions, *CkanInstall(ckan).compat_versions(game)]))
+        logging.info('Prefetching %s downloads with %s connections',
+                     len(downloads), self.connections)
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            results = list(executor.map(self.fetch, downloads))
+        return results.count(False)
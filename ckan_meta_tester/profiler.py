@@ -0,0 +1,60 @@
+import logging
+from cProfile import Profile
+from io import StringIO
+from pathlib import Path
+from pstats import Stats, SortKey
+from time import monotonic
+from types import TracebackType
+from typing import Type
+
+from .event_log import events
+from .log_group import LogGroup
+from .supervisor import Supervisor
+
+
+class Profiler:
+    """Profiles our own Python code and totals up the time spent
+    waiting for netkan.exe, ckan.exe and the linters, to tell which one made a run slow"""
+
+    def __init__(self, path: Path, top: int = 25) -> None:
+        self.path = path
+        self.top = top
+        self.profile = Profile()
+        self.start = 0.0
+        self.child_wall_before = 0.0
+
+    def __enter__(self) -> 'Profiler':
+        self.child_wall_before = Supervisor.usage.total_wall
+        self.start = monotonic()
+        # Only profiles this thread, so prefetching shows up as waiting for its workers
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type: Type[BaseException],
+                 exc_value: BaseException, traceback: TracebackType) -> None:
+        self.profile.disable()
+        wall = monotonic() - self.start
+        # Commands run one at a time while we wait for them,
+        # so whatever's left over is time spent in this process
+        child_wall = Supervisor.usage.total_wall - self.child_wall_before
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.profile.dump_stats(self.path)
+        logging.info('Saved profile to %s', self.path)
+        events.emit('profile', path=self.path, duration=round(wall, 3),
+                    child_duration=round(child_wall, 3),
+                    process_duration=round(wall - child_wall, 3))
+        with LogGroup('Profile'):
+            print(self.summary(wall, child_wall), flush=True)
+
+    def summary(self, wall: float, child_wall: float) -> str:
+        usage = Supervisor.usage
+        lines = [f'Total {wall:.1f} s: {child_wall:.1f} s in child processes, {wall - child_wall:.1f} s in process',
+                 *(f'    {phase}: {usage.commands[phase]} commands, {usage.wall[phase]:.1f} s, {usage.cpu[phase]:.1f} s CPU'
+                   for phase in sorted(usage.wall, key=usage.wall.__getitem__, reverse=True)),
+                 # Waiting for commands shows up as time in select and wait4
+                 f'Top {self.top} functions by own time:']
+        out = StringIO()
+        Stats(self.profile, stream=out).sort_stats(SortKey.TIME).print_stats(self.top)
+        # Skip pstats' own header
+        lines.extend(line for line in out.getvalue().splitlines()[4:] if line.strip())
+        return '\n'.join(lines)
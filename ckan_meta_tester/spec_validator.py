@@ -0,0 +1,118 @@
+import re
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .game_version import GameVersion
+
+
+class SpecProblem(NamedTuple):
+    message: str
+    line: Optional[int] = None
+
+
+class SpecValidator:
+    """Quick structural checks from the CKAN spec's schema,
+    to catch simple mistakes without waiting for netkan.exe"""
+
+    IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9-]+$')
+    SPEC_VERSION_PATTERN = re.compile(r'^v\d\.\d\d?$')
+
+    CKAN_REQUIRED = ['spec_version', 'identifier', 'name', 'abstract',
+                     'author', 'license', 'version']
+    NETKAN_REQUIRED = ['spec_version', 'identifier']
+    # Kinds that have nothing to download
+    NO_DOWNLOAD_KINDS = ['metapackage', 'dlc']
+    GAME_VERSION_FIELDS = ['ksp_version', 'ksp_version_min', 'ksp_version_max']
+
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self.suffix = file.suffix.lower()
+        self.text = file.read_text()
+        self.problems: List[SpecProblem] = []
+
+    def parse(self) -> Any:
+        if self.suffix == '.ckan':
+            return json.loads(self.text)
+        # Imported here so runs with only .ckans don't have to load it
+        import yaml  # pylint: disable=import-outside-toplevel
+        try:
+            # NetKAN reads YAML scalars as strings, so 1.10 stays 1.10
+            return yaml.load(self.text, Loader=yaml.BaseLoader)
+        except yaml.YAMLError as exc:
+            raise ValueError(str(exc)) from exc
+
+    def validate(self) -> List[SpecProblem]:
+        try:
+            doc = self.parse()
+        except ValueError as exc:
+            # jsonlint and yamllint explain syntax errors better than we can
+            logging.debug('Skipping spec checks for %s: %s', self.file, exc)
+            return []
+        if not isinstance(doc, dict):
+            return [SpecProblem('Metadata must be an object', 1)]
+        self.check_required(doc)
+        self.check_spec_version(doc)
+        self.check_identifier(doc)
+        self.check_game_versions(doc)
+        return self.problems
+
+    def check_required(self, doc: Dict[str, Any]) -> None:
+        for field in (self.CKAN_REQUIRED if self.suffix == '.ckan' else self.NETKAN_REQUIRED):
+            if field not in doc:
+                self.problem(f'Required property {field} is missing')
+        if self.suffix == '.ckan' and 'download' not in doc \
+                and doc.get('kind') not in self.NO_DOWNLOAD_KINDS:
+            self.problem('Required property download is missing')
+
+    def check_spec_version(self, doc: Dict[str, Any]) -> None:
+        spec_version = doc.get('spec_version')
+        if spec_version is None or spec_version in (1, '1'):
+            return
+        if not isinstance(spec_version, str) or not self.SPEC_VERSION_PATTERN.match(spec_version):
+            self.problem(f'spec_version must be 1 or look like v1.34, not {spec_version}',
+                         'spec_version')
+
+    def check_identifier(self, doc: Dict[str, Any]) -> None:
+        identifier = doc.get('identifier')
+        if identifier is None:
+            return
+        if not isinstance(identifier, str) or not self.IDENTIFIER_PATTERN.match(identifier):
+            self.problem(f'Identifier {identifier} must contain only letters, numbers and dashes, and not start with a dash',
+                         'identifier')
+            return
+        if self.suffix == '.ckan':
+            if len(self.file.parts) == 2 and self.file.parent.name != identifier:
+                self.problem(f'{self.file.name} should be in a folder named {identifier}, not {self.file.parent.name}',
+                             'identifier')
+        elif self.file.parts[0] == 'NetKAN' and self.file.stem != identifier:
+            self.problem(f'{self.file.name} should be named {identifier}.netkan to match its identifier',
+                         'identifier')
+
+    def check_game_versions(self, doc: Dict[str, Any]) -> None:
+        if 'ksp_version' in doc and ('ksp_version_min' in doc or 'ksp_version_max' in doc):
+            self.problem('ksp_version cannot be combined with ksp_version_min or ksp_version_max',
+                         'ksp_version')
+        for field in self.GAME_VERSION_FIELDS:
+            if field not in doc:
+                continue
+            val = doc[field]
+            if not isinstance(val, str):
+                self.problem(f'{field} must be a string, put quotes around {val}', field)
+                continue
+            try:
+                GameVersion(val)
+            except TypeError as exc:
+                self.problem(str(exc), field)
+
+    def problem(self, message: str, field: Optional[str] = None) -> None:
+        self.problems.append(SpecProblem(message, self.line_of(field) if field else None))
+
+    def line_of(self, field: str) -> Optional[int]:
+        # Matches both "field": in JSON and field: in YAML
+        pattern = re.compile(rf'^\s*"?{re.escape(field)}"?\s*:')
+        for num, line in enumerate(self.text.splitlines(), start=1):
+            if pattern.match(line):
+                return num
+        return None
@@ -0,0 +1,21 @@
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+
+def load_json(path: Path, default: Any) -> Any:
+    if path.is_file():
+        try:
+            return json.loads(path.read_text())
+        except ValueError:
+            logging.warning('Ignoring corrupt state file %s', path)
+    return default
+
+
+def save_json(path: Path, data: Any) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so a cancelled job can't leave half a file in the cache
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(data, indent=4, sort_keys=True))
+    tmp.replace(path)
@@ -0,0 +1,226 @@
+import os
+import logging
+from codecs import getincrementaldecoder
+from io import IncrementalNewlineDecoder
+from locale import getpreferredencoding
+from pathlib import Path
+from selectors import DefaultSelector, EVENT_READ
+from signal import SIGTERM, SIGKILL
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, CalledProcessError
+from time import monotonic, sleep
+from types import TracebackType
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Type
+
+
+class Timeouts(NamedTuple):
+    # Seconds the whole command may take
+    wall: float
+    # Seconds the command may go without printing anything
+    idle: float
+
+
+class CommandTimeout(Exception):
+    """A command took too long or went quiet and was killed"""
+
+
+class ChildUsage:
+    """Totals of the time spent waiting for commands, by phase"""
+
+    def __init__(self) -> None:
+        self.commands: Dict[str, int] = {}
+        self.wall: Dict[str, float] = {}
+        self.cpu: Dict[str, float] = {}
+
+    def add(self, phase: str, wall: float, cpu: Optional[float]) -> None:
+        self.commands[phase] = self.commands.get(phase, 0) + 1
+        self.wall[phase] = self.wall.get(phase, 0) + wall
+        self.cpu[phase] = self.cpu.get(phase, 0) + (cpu or 0)
+
+    @property
+    def total_wall(self) -> float:
+        return sum(self.wall.values())
+
+
+class Supervisor:
+    """Runs a command in its own process group, streaming its output,
+    and kills the whole group if it takes too long or goes quiet"""
+
+    TIMEOUTS: Dict[Optional[str], Timeouts] = {
+        None:       Timeouts(3600, 900),
+        'lint':     Timeouts(300,  120),
+        'inflate':  Timeouts(1800, 600),
+        'validate': Timeouts(1800, 600),
+        'instance': Timeouts(1800, 600),
+        'install':  Timeouts(3600, 900),
+    }
+    # Time to clean up after SIGTERM before SIGKILL
+    GRACE_SECONDS = 5
+    # Every command we've run, for the profiler
+    usage = ChildUsage()
+    READ_SIZE = 65536
+
+    def __init__(self, cmd: List[Any], phase: Optional[str] = None,
+                 input_str: Optional[str] = None) -> None:
+        self.cmd = cmd
+        self.phase = phase
+        self.input_str = input_str
+        self.timeouts = self.TIMEOUTS.get(phase, self.TIMEOUTS[None])
+        self.proc: Optional[Popen] = None
+        self.start = 0.0
+        self.end: Optional[float] = None
+        self.timed_out: Optional[str] = None
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[Any] = None
+
+    @classmethod
+    def configure(cls, spec: str) -> None:
+        """Override timeouts from a string like 'inflate=1800/600 install=3600/900'"""
+        for item in spec.replace(',', ' ').split():
+            phase, _, vals = item.partition('=')
+            wall, _, idle = vals.partition('/')
+            prev = cls.TIMEOUTS.get(phase, cls.TIMEOUTS[None])
+            cls.TIMEOUTS[phase] = Timeouts(float(wall) if wall else prev.wall,
+                                           float(idle) if idle else prev.idle)
+            logging.debug('Timeouts for %s: %s', phase, cls.TIMEOUTS[phase])
+
+    @property
+    def name(self) -> str:
+        # The full command line can contain the GitHub token
+        args = [str(arg) for arg in self.cmd]
+        return Path(args[1] if args[0] == 'mono' and len(args) > 1 else args[0]).name
+
+    def __enter__(self) -> 'Supervisor':
+        self.start = monotonic()
+        self.proc = Popen(self.cmd,  # pylint: disable=consider-using-with
+                          stdin=(PIPE if self.input_str else DEVNULL),
+                          stdout=PIPE, stderr=STDOUT,
+                          # Own process group, so we can kill its children too
+                          start_new_session=True)
+        if self.input_str and self.proc.stdin is not None:
+            self.proc.stdin.write(self.input_str.encode(getpreferredencoding(False)))
+            self.proc.stdin.flush()
+            self.proc.stdin.close()
+        return self
+
+    def __exit__(self, exc_type: Type[BaseException],
+                 exc_value: BaseException, traceback: TracebackType) -> None:
+        if self.returncode is None:
+            self.kill()
+        if self.proc is not None and self.proc.stdout is not None:
+            self.proc.stdout.close()
+
+    def lines(self) -> Iterator[str]:
+        if self.proc is None or self.proc.stdout is None:
+            return
+        # Same decoding as Popen(text=True)
+        decoder = IncrementalNewlineDecoder(
+            getincrementaldecoder(getpreferredencoding(False))(errors='replace'),
+            translate=True)
+        pending = ''
+        last_output = monotonic()
+        with DefaultSelector() as selector:
+            selector.register(self.proc.stdout, EVENT_READ)
+            while True:
+                now = monotonic()
+                wall_left = self.timeouts.wall - (now - self.start)
+                idle_left = self.timeouts.idle - (now - last_output)
+                if wall_left <= 0:
+                    self.timed_out = f'took longer than {self.timeouts.wall:g} seconds'
+                    break
+                if idle_left <= 0:
+                    self.timed_out = f'printed nothing for {self.timeouts.idle:g} seconds'
+                    break
+                if not selector.select(min(wall_left, idle_left)):
+                    continue
+                chunk = os.read(self.proc.stdout.fileno(), self.READ_SIZE)
+                last_output = monotonic()
+                pending += decoder.decode(chunk, final=not chunk)
+                *complete, pending = pending.split('\n')
+                for line in complete:
+                    yield line + '\n'
+                if not chunk:
+                    break
+        if pending:
+            yield pending
+        if self.timed_out:
+            logging.warning('%s %s, killing it', self.name, self.timed_out)
+            self.kill()
+
+    def wait(self) -> int:
+        while self.returncode is None and self.proc is not None:
+            if not self.reap():
+                if monotonic() - self.start > self.timeouts.wall:
+                    # Closed its output but kept running
+                    self.timed_out = f'took longer than {self.timeouts.wall:g} seconds'
+                    self.kill()
+                else:
+                    sleep(0.05)
+        return self.returncode if self.returncode is not None else -1
+
+    def reap(self) -> bool:
+        if self.proc is None:
+            return False
+        # wait4 instead of Popen.wait to get the child's resource usage
+        pid, status, rusage = os.wait4(self.proc.pid, os.WNOHANG)
+        if pid == 0:
+            return False
+        self.rusage = rusage
+        self.finish(status)
+        return True
+
+    def kill(self) -> None:
+        if self.proc is None or self.returncode is not None:
+            return
+        for sig in (SIGTERM, SIGKILL):
+            try:
+                os.killpg(self.proc.pid, sig)
+            except ProcessLookupError:
+                pass
+            deadline = monotonic() + self.GRACE_SECONDS
+            while monotonic() < deadline:
+                if self.reap():
+                    return
+                sleep(0.1)
+
+    def finish(self, status: int) -> None:
+        self.end = monotonic()
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.usage.add(self.phase or 'other', self.duration, self.cpu_seconds)
+        if self.proc is not None:
+            # Stop Popen from trying to reap it again
+            self.proc.returncode = self.returncode
+        if self.rusage is not None:
+            logging.debug('%s took %.1f s, used %.1f s CPU, peak RSS %s MiB',
+                          self.name, self.duration, self.cpu_seconds,
+                          self.rusage.ru_maxrss // 1024)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or monotonic()) - self.start
+
+    @property
+    def cpu_seconds(self) -> Optional[float]:
+        return (None if self.rusage is None
+                else self.rusage.ru_utime + self.rusage.ru_stime)
+
+    @property
+    def peak_rss_kb(self) -> Optional[int]:
+        # Linux reports ru_maxrss in kilobytes
+        return None if self.rusage is None else self.rusage.ru_maxrss
+
+
+def run(cmd: List[Any], capture_output: bool = False, check: bool = False,
+        phase: Optional[str] = 'instance') -> int:
+    """Drop-in for the subprocess.run calls that don't need their output.
+    Raises CommandTimeout if the command is killed, even with check=False,
+    since whatever it was setting up is incomplete."""
+    with Supervisor(cmd, phase) as sup:
+        for line in sup.lines():
+            if not capture_output:
+                print(line, end='', flush=True)
+        returncode = sup.wait()
+        if sup.timed_out:
+            raise CommandTimeout(f'{sup.name} {sup.timed_out} and was killed')
+        if check and returncode != 0:
+            raise CalledProcessError(returncode, sup.name)
+        return returncode
@@ -23,6 +23,7 @@ setup(
         'requests',
         'demjson3',
         'yamllint',
+        'pyyaml',
     ],
     extras_require={
         'development': [
@@ -3,3 +3,12 @@ from .log_group import *
 from .game_version import *
 from .dummy_game_instance import *
 from .ckan_install import *
+from .duration_history import *
+from .install_results import *
+from .spec_validator import *
+from .event_log import *
+from .download_cache import *
+from .prefetch import *
+from .supervisor import *
+from .incremental_state import *
+from .profiler import *
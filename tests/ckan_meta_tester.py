@@ -1,10 +1,25 @@
+import sys
 import unittest
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, call
 
 from ckan_meta_tester.ckan_meta_tester import CkanMetaTester
+from ckan_meta_tester.game_version import GameVersion
+from ckan_meta_tester.state_file import save_json
 
 
 class TestCkanMetaTester(unittest.TestCase):
 
+    def setUp(self) -> None:
+        # Keep the durations and other state out of the checkout
+        self.tempdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        state_path = patch.object(CkanMetaTester, 'STATE_PATH', Path(self.tempdir.name))
+        state_path.start()
+        self.addCleanup(state_path.stop)
+        self.addCleanup(self.tempdir.cleanup)
+
     def test_true(self) -> None:
         tester = CkanMetaTester(False, 'KSP')
         self.assertTrue(tester.test_metadata())
@@ -19,3 +34,247 @@ class TestCkanMetaTester(unittest.TestCase):
         ckan compat add 1.12""")
 
         self.assertListEqual(next(iter(result)), ["Astrogator", "ModuleManager=4.2.1"])
+
+    def test_shards_partition_files(self) -> None:
+        # Arrange
+        files = [Path('NetKAN') / f'Mod{i}.netkan' for i in range(50)]
+        testers = [CkanMetaTester(False, 'KSP', index, 3) for index in range(3)]
+
+        # Act
+        shards = [set(tester.shard_files(files)) for tester in testers]
+
+        # Assert
+        self.assertSetEqual(shards[0] | shards[1] | shards[2], set(files))
+        self.assertFalse(shards[0] & shards[1])
+        self.assertFalse(shards[0] & shards[2])
+        self.assertFalse(shards[1] & shards[2])
+
+    def test_shard_history_partitions_files(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            # Arrange
+            history = Path(tmpdir) / 'durations.json'
+            save_json(history, {f'Mod{i}': {'test': 100.0 if i == 3 else 10.0} for i in range(10)})
+            files = [Path('NetKAN') / f'Mod{i}.netkan' for i in range(10)]
+            testers = [CkanMetaTester(False, 'KSP', index, 2, shard_history=history)
+                       for index in range(2)]
+
+            # Act
+            shards = [set(tester.shard_files(files)) for tester in testers]
+
+            # Assert
+            self.assertSetEqual(shards[0] | shards[1], set(files))
+            self.assertFalse(shards[0] & shards[1])
+            self.assertSetEqual(shards[0], {Path('NetKAN/Mod3.netkan')})
+
+    def test_shard_coverage(self) -> None:
+        files = [Path('NetKAN') / f'Mod{i}.netkan' for i in range(20)]
+        for lost in (False, True):
+            with self.subTest(lost=lost), TemporaryDirectory() as tmpdir:
+                # Arrange
+                shards_path = Path(tmpdir)
+                for index in range(3):
+                    tester = CkanMetaTester(False, 'KSP', index, 3)
+                    tester.shard_files(files[1:] if lost and index == 2 else files)
+                    with patch.object(CkanMetaTester, 'INFLATED_PATH', shards_path / f'ckans-{index}'):
+                        tester.save_shard_manifest()
+                merger = CkanMetaTester(False, 'KSP')
+
+                # Act
+                with patch('builtins.print'):
+                    covered = merger.check_shard_coverage(shards_path)
+
+                # Assert
+                self.assertEqual(covered, not lost)
+
+    def test_merge_shards_maps_sources(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            # Arrange
+            shard = Path(tmpdir) / 'shards' / 'ckans-0'
+            shard.mkdir(parents=True)
+            shard.joinpath('Astrogator-v1.0.ckan').write_text('{"identifier": "Astrogator"}')
+            shard.joinpath('Other-v1.0.ckan').write_text('{"identifier": "Other"}')
+            save_json(shard / 'shard-0.json',
+                      {'ckans': {'Astrogator-v1.0.ckan': 'NetKAN/Astrogator.netkan'}})
+            tester = CkanMetaTester(False, 'KSP')
+            tester.inflated_path = Path(tmpdir) / 'merged'
+            tester.inflated_path.mkdir()
+
+            # Act
+            tester.merge_shards(Path(tmpdir) / 'shards')
+
+            # Assert
+            self.assertDictEqual(dict(tester.source_to_ckans), {
+                Path('NetKAN/Astrogator.netkan'): [tester.inflated_path / 'Astrogator-v1.0.ckan'],
+                # No manifest entry and no matching .netkan
+                shard / 'Other-v1.0.ckan': [tester.inflated_path / 'Other-v1.0.ckan'],
+            })
+
+    def test_merge_shards_prioritizes(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            # Arrange
+            shards = Path(tmpdir) / 'shards'
+            for index, (identifier, added) in enumerate([('Old', False), ('New', True), ('Asked', False)]):
+                shard = shards / f'ckans-{index}'
+                shard.mkdir(parents=True)
+                shard.joinpath(f'{identifier}-v1.0.ckan').write_text(f'{{"identifier": "{identifier}"}}')
+                source = f'NetKAN/{identifier}.netkan'
+                save_json(shard / f'shard-{index}.json',
+                          {'files': [source], 'added': [source] if added else [],
+                           'ckans': {f'{identifier}-v1.0.ckan': source}})
+            tester = CkanMetaTester(False, 'KSP')
+            tester.inflated_path = Path(tmpdir) / 'merged'
+            tester.inflated_path.mkdir()
+
+            # Act
+            tester.merge_shards(shards, 'ckan install Asked')
+
+            # Assert
+            self.assertListEqual(list(tester.source_to_ckans), [Path('NetKAN/Asked.netkan'),
+                                                                Path('NetKAN/New.netkan'),
+                                                                Path('NetKAN/Old.netkan')])
+
+    def test_held_annotations(self) -> None:
+        # Arrange
+        tester = CkanMetaTester(False, 'KSP')
+        held: list = []
+
+        # Act
+        with patch('builtins.print'), \
+             patch('ckan_meta_tester.ckan_meta_tester.annotate') as mock_annotate:
+            passed = tester.run_for_file(
+                None, ['sh', '-c', 'echo "1 WARN Old version"; echo "2 ERROR Not found"'],
+                held_annotations=held)
+
+        # Assert
+        self.assertTrue(passed)
+        self.assertListEqual(held, [('warning', '1 WARN Old version\n'),
+                                    ('error', '2 ERROR Not found\n')])
+        mock_annotate.assert_not_called()
+
+    def test_pr_body_tests_annotate_held(self) -> None:
+        # Arrange
+        tester = CkanMetaTester(False, 'KSP')
+
+        def install(identifier_sets: list, versions: list, held: list) -> bool:
+            held.extend([('warning', '1 WARN Old version\n'), ('error', '2 ERROR Not found\n')])
+            return True
+
+        # Act
+        with patch.object(tester, 'install_identifiers', side_effect=install), \
+             patch('ckan_meta_tester.ckan_meta_tester.annotate') as mock_annotate:
+            passed = tester.install_pr_body_tests(self.PR_BODY)
+
+        # Assert
+        self.assertTrue(passed)
+        self.assertListEqual(mock_annotate.call_args_list, [
+            call('warning', '1 WARN Old version\n', phase='install', end=''),
+            call('error', '2 ERROR Not found\n', phase='install', end=''),
+        ])
+
+    def test_invalid_shard(self) -> None:
+        with self.assertRaises(ValueError):
+            CkanMetaTester(False, 'KSP', 3, 3)
+
+    def test_incremental_shards(self) -> None:
+        with self.assertRaises(ValueError):
+            CkanMetaTester(False, 'KSP', 0, 2, incremental_refresh=1)
+
+    def test_prioritize(self) -> None:
+        # Arrange
+        tester = CkanMetaTester(False, 'KSP')
+        tester.added_files = {Path('NetKAN/Brand-New.netkan')}
+        files = [Path('NetKAN/Old-Mod.netkan'),
+                 Path('NetKAN/Brand-New.netkan'),
+                 Path('Astrogator/Astrogator-v1.0.ckan')]
+
+        # Act
+        ordered = tester.prioritize(files, 'ckan install Astrogator ModuleManager=4.2.1')
+
+        # Assert
+        self.assertListEqual(ordered, [Path('Astrogator/Astrogator-v1.0.ckan'),
+                                       Path('NetKAN/Brand-New.netkan'),
+                                       Path('NetKAN/Old-Mod.netkan')])
+
+    def test_multiple_games(self) -> None:
+        # Arrange
+        tester = CkanMetaTester(False, 'KSP, KSP2')
+
+        # Act
+        tester.use_game(tester.games[1])
+
+        # Assert
+        self.assertListEqual([game.short_name for game in tester.games], ['KSP', 'KSP2'])
+        self.assertEqual(tester.inflated_path, CkanMetaTester.INFLATED_PATH / 'KSP2')
+        self.assertEqual(tester.tiny_repo, CkanMetaTester.REPO_PATH / 'KSP2' / 'metadata.tar.gz')
+        self.assertEqual(tester.saved_registry, Path('/tmp/registry-KSP2.json'))
+        self.assertEqual(tester.phase_key('install'), 'install KSP2')
+
+    def test_game_failures_are_separate(self) -> None:
+        # Arrange
+        tester = CkanMetaTester(False, 'KSP KSP2')
+        tester.use_game(tester.games[1])
+        # The first game failed
+        tester.failed = True
+
+        # Act
+        passed = tester.test_game([], None, False, None, None, None)
+
+        # Assert
+        self.assertTrue(passed)
+        self.assertTrue(tester.failed)
+
+    def test_single_game_paths(self) -> None:
+        tester = CkanMetaTester(False, 'KSP')
+        self.assertEqual(tester.inflated_path, CkanMetaTester.INFLATED_PATH)
+        self.assertEqual(tester.tiny_repo, CkanMetaTester.TINY_REPO)
+        self.assertEqual(tester.phase_key('install'), 'install')
+
+    def test_lazy_imports(self) -> None:
+        # Arrange
+        heavy = ['git', 'requests', 'netkan.repos', 'configparser']
+
+        # Act
+        result = subprocess.run([sys.executable, '-c',
+                                 'import sys, ckan_meta_tester; print(" ".join(sys.modules))'],
+                                capture_output=True, text=True, check=True)
+
+        # Assert
+        self.assertListEqual([mod for mod in heavy if mod in result.stdout.split()], [])
+
+    PR_BODY = """
+        ckan compat add 1.11 1.12
+        ckan install Astrogator
+        ckan install ModuleManager=4.2.1 Kopernicus"""
+
+    def test_pr_body_tests_share_one_session(self) -> None:
+        # Arrange
+        tester = CkanMetaTester(False, 'KSP')
+
+        # Act
+        with patch.object(tester, 'install_identifiers', return_value=True) as install:
+            passed = tester.install_pr_body_tests(self.PR_BODY)
+
+        # Assert
+        self.assertTrue(passed)
+        install.assert_called_once_with(
+            [['Astrogator'], ['ModuleManager=4.2.1', 'Kopernicus']],
+            [GameVersion('1.11'), GameVersion('1.12')],
+            [])
+
+    def test_pr_body_tests_retry_separately(self) -> None:
+        # Arrange
+        tester = CkanMetaTester(False, 'KSP')
+        versions = [GameVersion('1.11'), GameVersion('1.12')]
+
+        # Act
+        with patch.object(tester, 'install_identifiers',
+                          side_effect=[False, True, False]) as install:
+            passed = tester.install_pr_body_tests(self.PR_BODY)
+
+        # Assert
+        self.assertFalse(passed)
+        self.assertListEqual(install.call_args_list, [
+            call([['Astrogator'], ['ModuleManager=4.2.1', 'Kopernicus']], versions, []),
+            call([['Astrogator']], versions),
+            call([['ModuleManager=4.2.1', 'Kopernicus']], versions),
+        ])
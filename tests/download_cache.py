@@ -0,0 +1,123 @@
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import sleep
+from typing import List
+from unittest import TestCase
+
+import requests
+
+from ckan_meta_tester.download_cache import DownloadCache
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    CONTENTS = b'PK fake zip contents'
+    requests: List[str] = []
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        self.requests.append(self.path)
+        # Slow enough that concurrent fetches overlap
+        sleep(0.2)
+        if self.path.endswith('missing.zip'):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.CONTENTS)))
+        self.end_headers()
+        self.wfile.write(self.CONTENTS)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+class TestDownloadCache(TestCase):
+
+    def setUp(self) -> None:
+        StubHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.tempdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache_path = Path(self.tempdir.name)
+        self.cache = DownloadCache(self.cache_path, self.cache_path / 'meta_tester', 'test')
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.tempdir.cleanup()
+
+    def test_cache_filename(self) -> None:
+        # Act / Assert
+        self.assertEqual(DownloadCache.cache_filename('https://example.com/download/Mod%20Name.zip'),
+                         'DBEA8C2D-Mod Name.zip')
+        self.assertEqual(DownloadCache.cache_filename('https://example.com/x', 'Mod-1.0.zip'),
+                         '4701CD48-Mod-1.0.zip')
+
+    def test_concurrent_fetches_download_once(self) -> None:
+        # Arrange
+        url = f'{self.base_url}/mod.zip'
+        results: List[Path] = []
+
+        # Act
+        threads = [Thread(target=lambda: results.append(self.cache.fetch(url)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        self.assertEqual(StubHandler.requests, ['/mod.zip'])
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(results[0].read_bytes(), StubHandler.CONTENTS)
+        self.assertEqual(results[0].parent, self.cache_path)
+        self.assertEqual(self.cache.manifest()[url]['file'], results[0].name)
+        self.assertEqual(list((self.cache_path / 'meta_tester' / 'downloading').iterdir()), [])
+
+    def test_locks_shared_between_urls(self) -> None:
+        # Act
+        for num in range(3):
+            self.cache.fetch(f'{self.base_url}/mod{num}.zip')
+
+        # Assert
+        self.assertCountEqual([path.name for path in self.cache.locks_path.iterdir()],
+                              ['manifest.lock',
+                               *{f'{DownloadCache.url_hash(f"{self.base_url}/mod{num}.zip")[:2]}.lock'
+                                 for num in range(3)}])
+
+    def test_stale_cached_file_downloaded_again(self) -> None:
+        # Arrange
+        url = f'{self.base_url}/mod.zip'
+        stale = self.cache_path / DownloadCache.cache_filename(url, 'Mod-1.0.zip')
+        stale.write_bytes(b'PK old contents')
+
+        # Act
+        with self.assertLogs(level='WARNING'):
+            result = self.cache.fetch(url, 'Mod-1.0.zip',
+                                      sha256(StubHandler.CONTENTS).hexdigest())
+
+        # Assert
+        self.assertEqual(StubHandler.requests, ['/mod.zip'])
+        self.assertEqual(result.read_bytes(), StubHandler.CONTENTS)
+
+    def test_hash_mismatch(self) -> None:
+        # Arrange
+        url = f'{self.base_url}/mod.zip'
+
+        # Act / Assert
+        with self.assertRaises(ValueError):
+            self.cache.fetch(url, sha256_hash='0' * 64)
+        self.assertIsNone(self.cache.cached(url))
+        self.assertEqual(self.cache.fetch(url, sha256_hash=sha256(StubHandler.CONTENTS).hexdigest()).read_bytes(),
+                         StubHandler.CONTENTS)
+
+    def test_failed_download(self) -> None:
+        # Arrange
+        url = f'{self.base_url}/missing.zip'
+
+        # Act / Assert
+        with self.assertRaises(requests.HTTPError):
+            self.cache.fetch(url)
+        self.assertIsNone(self.cache.cached(url))
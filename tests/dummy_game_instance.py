@@ -1,4 +1,5 @@
 from pathlib import Path, PosixPath
+from tempfile import TemporaryDirectory
 import unittest.util
 from unittest import TestCase
 from unittest.mock import Mock, patch, call
@@ -6,6 +7,7 @@ from unittest.mock import Mock, patch, call
 from ckan_meta_tester.game import Game
 from ckan_meta_tester.game_version import GameVersion
 from ckan_meta_tester.dummy_game_instance import DummyGameInstance
+from ckan_meta_tester.supervisor import CommandTimeout
 
 
 class TestDummyGameInstance(TestCase):
@@ -76,3 +78,35 @@ class TestDummyGameInstance(TestCase):
             call(['mono', '/ckan.exe', 'instance', 'forget', 'dummy'],
                  capture_output=True, check=False)
         ])
+
+    def test_repo_data_files(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            # Arrange
+            repos = Path(tmpdir) / 'CKAN' / 'repos'
+            repos.mkdir(parents=True)
+            repos.joinpath('B0F8A2C7.json').write_text('{}')
+            repos.joinpath('4A1E39D0.json').write_text('{}')
+
+            # Act
+            with patch.dict('os.environ', {'XDG_CONFIG_HOME': tmpdir}):
+                files = DummyGameInstance.repo_data_files()
+
+            # Assert
+            self.assertListEqual(files, [repos / '4A1E39D0.json', repos / 'B0F8A2C7.json'])
+
+    @patch('ckan_meta_tester.dummy_game_instance.rmtree')
+    @patch('ckan_meta_tester.dummy_game_instance.Path.mkdir')
+    def test_timeout_removes_instance(self, mocked_mkdir: Mock, mocked_rmtree: Mock) -> None:
+        # Arrange
+        mock_game = Mock(short_name='KSP', dlc_cmdline_flags=Mock(return_value=[]))
+        instance = DummyGameInstance(Path('/game-instance'), ['ckan'], Path('/repo.tar.gz'),
+                                     GameVersion('1.12'), [], Path('/cache'), mock_game, None)
+
+        # Act / Assert
+        with patch('ckan_meta_tester.dummy_game_instance.run',
+                   side_effect=[CommandTimeout('ckan timed out'), 0]) as mocked_run:
+            with self.assertRaises(CommandTimeout):
+                with instance:
+                    self.fail('Should not get here')
+        self.assertEqual(mocked_run.call_args_list[-1].args[0], ['ckan', 'instance', 'forget', 'dummy'])
+        mocked_rmtree.assert_called_once_with(Path('/game-instance'))
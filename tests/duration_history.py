@@ -0,0 +1,45 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ckan_meta_tester.duration_history import DurationHistory, lpt_schedule
+
+
+class TestDurationHistory(TestCase):
+
+    def test_record_and_estimate(self) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            path = Path(tempdirname) / 'durations.json'
+            history = DurationHistory(path)
+
+            # Act
+            history.record('Astrogator', 'test', 30)
+            history.record('Astrogator', 'install', 50)
+            history.record('Astrogator', 'install', 70)
+            history.save()
+            reloaded = DurationHistory(path)
+
+            # Assert
+            self.assertEqual(reloaded.estimate('Astrogator'), 90)
+            self.assertIsNone(reloaded.estimate('ModuleManager'))
+            self.assertEqual(reloaded.costs({'a': 'Astrogator', 'b': 'ModuleManager'}),
+                             {'a': 90, 'b': 90})
+
+    def test_missing_history(self) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            history = DurationHistory(Path(tempdirname) / 'durations.json')
+
+            # Act / Assert
+            self.assertEqual(history.default_cost(), DurationHistory.DEFAULT_SECONDS)
+
+    def test_lpt_schedule(self) -> None:
+        # Arrange
+        costs = {'huge': 360.0, 'big': 120.0, 'medium': 100.0, 'small': 20.0, 'tiny': 10.0}
+
+        # Act
+        schedule = lpt_schedule(costs, 2)
+
+        # Assert
+        self.assertEqual(schedule, [['huge'], ['big', 'medium', 'small', 'tiny']])
@@ -0,0 +1,72 @@
+import json
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+import ckan_meta_tester
+from ckan_meta_tester.event_log import events, annotate
+from ckan_meta_tester.log_group import LogGroup
+
+
+class TestEventLog(TestCase):
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_annotations_unchanged(self, mock_stdout: StringIO) -> None:
+        # Act
+        annotate('error', 'Bad thing', Path('NetKAN/Mod.netkan'))
+        annotate('error', 'Bad line', Path('Mod/Mod-1.0.ckan'), '3', '14')
+        annotate('warning', 'Odd thing\n', end='')
+        annotate('notice', 'Skipped')
+
+        # Assert
+        self.assertEqual(mock_stdout.getvalue(), '\n'.join([
+            '::error file=NetKAN/Mod.netkan::Bad thing',
+            '::error file=Mod/Mod-1.0.ckan,line=3,col=14::Bad line',
+            '::warning::Odd thing',
+            '::notice::Skipped',
+            '']))
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_events_written(self, mock_stdout: StringIO) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            path = Path(tempdirname) / 'events.jsonl'
+            events.open(path)
+
+            # Act
+            try:
+                with LogGroup('Inflating NetKAN/Mod.netkan'):
+                    annotate('error', 'Line one%0ALine two', Path('Mod/Mod-1.0.ckan'), '3', '14',
+                             phase='lint')
+            finally:
+                events.close()
+            records = [json.loads(line) for line in path.read_text().splitlines()]
+
+            # Assert
+            self.assertListEqual([rec['event'] for rec in records],
+                                 ['group_start', 'annotation', 'group_end'])
+            self.assertEqual(records[1]['file'], 'Mod/Mod-1.0.ckan')
+            self.assertEqual(records[1]['phase'], 'lint')
+            self.assertEqual(records[1]['severity'], 'error')
+            self.assertEqual(records[1]['line'], 3)
+            self.assertEqual(records[1]['col'], 14)
+            self.assertEqual(records[1]['message'], 'Line one\nLine two')
+            self.assertIn('duration', records[2])
+
+    def test_run_end_after_exception(self) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            path = Path(tempdirname) / 'events.jsonl'
+
+            # Act
+            with patch.dict('os.environ', {'INPUT_EVENT_LOG': str(path)}), \
+                 patch('ckan_meta_tester.run_tester', side_effect=RuntimeError('Boom')):
+                with self.assertRaises(RuntimeError):
+                    ckan_meta_tester.test_metadata()
+
+            # Assert
+            last = json.loads(path.read_text().splitlines()[-1])
+            self.assertEqual(last['event'], 'run_end')
+            self.assertEqual(last['severity'], 'error')
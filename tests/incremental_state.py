@@ -0,0 +1,61 @@
+from os import chdir, getcwd
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from ckan_meta_tester.incremental_state import IncrementalState
+
+
+class TestIncrementalState(TestCase):
+
+    def setUp(self) -> None:
+        # The state stores paths relative to the repo root
+        self.prev_dir = getcwd()
+        self.tempdir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        chdir(self.tempdir.name)
+        self.state_path = Path('.cache/meta_tester/incremental.json')
+        self.files = [Path(f'Mod{i}.netkan') for i in range(4)]
+        for file in self.files:
+            file.write_text(f'identifier: {file.stem}')
+
+    def tearDown(self) -> None:
+        chdir(self.prev_dir)
+        self.tempdir.cleanup()
+
+    def test_first_run_tests_everything(self) -> None:
+        # Arrange
+        state = IncrementalState(self.state_path, 1)
+
+        # Act / Assert
+        self.assertListEqual(state.select(self.files, 'builds'), self.files)
+
+    def test_changed_and_oldest_unchanged(self) -> None:
+        # Arrange
+        state = IncrementalState(self.state_path, 1)
+        state.select(self.files, 'builds')
+        for when, file in enumerate(self.files):
+            with patch('ckan_meta_tester.incremental_state.time', return_value=float(when)):
+                state.record_success(file)
+        state.forget(self.files[3])
+        state.save()
+        self.files[2].write_text('identifier: Changed')
+
+        # Act
+        selected = IncrementalState(self.state_path, 1).select(self.files, 'builds')
+
+        # Assert
+        self.assertListEqual(selected, [self.files[0], self.files[2], self.files[3]])
+
+    def test_new_builds_test_everything(self) -> None:
+        # Arrange
+        state = IncrementalState(self.state_path, 0)
+        state.select(self.files, 'builds')
+        for file in self.files:
+            state.record_success(file)
+        state.save()
+
+        # Act / Assert
+        self.assertListEqual(IncrementalState(self.state_path, 0).select(self.files, 'builds'), [])
+        self.assertListEqual(IncrementalState(self.state_path, 0).select(self.files, 'new builds'),
+                             self.files)
@@ -0,0 +1,54 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from ckan_meta_tester.install_results import InstallResults
+
+
+class TestInstallResults(TestCase):
+
+    def test_key_depends_on_inputs(self) -> None:
+        # Arrange
+        key = InstallResults.key(b'{}', ['1.10', '1.11', '1.12'], None, [b'registry', b'repo'])
+
+        # Act / Assert
+        self.assertEqual(key, InstallResults.key(b'{}', ['1.11', '1.10', '1.12'], 'stable', [b'registry', b'repo']))
+        self.assertNotEqual(key, InstallResults.key(b'{ }', ['1.10', '1.11', '1.12'], None, [b'registry', b'repo']))
+        self.assertNotEqual(key, InstallResults.key(b'{}', ['1.11', '1.12'], None, [b'registry', b'repo']))
+        # Same versions, but a different one for the instance itself
+        self.assertNotEqual(key, InstallResults.key(b'{}', ['1.10', '1.12', '1.11'], None, [b'registry', b'repo']))
+        self.assertNotEqual(key, InstallResults.key(b'{}', ['1.10', '1.11', '1.12'], 'testing', [b'registry', b'repo']))
+        self.assertNotEqual(key, InstallResults.key(b'{}', ['1.10', '1.11', '1.12'], None, [b'registry2', b'repo']))
+        self.assertNotEqual(key, InstallResults.key(b'{}', ['1.10', '1.11', '1.12'], None, [b'registry', b'repo2']))
+
+    def test_results_persist_until_expired(self) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            path = Path(tempdirname) / 'installs.json'
+            results = InstallResults(path, 60)
+            with patch('ckan_meta_tester.install_results.time', return_value=1000.0):
+                results.record('abc')
+            results.save()
+
+            # Act
+            with patch('ckan_meta_tester.install_results.time', return_value=1030.0):
+                fresh = InstallResults(path, 60)
+            with patch('ckan_meta_tester.install_results.time', return_value=1090.0):
+                stale = InstallResults(path, 60)
+
+            # Assert
+            self.assertTrue(fresh.known_good('abc'))
+            self.assertFalse(fresh.known_good('def'))
+            self.assertFalse(stale.known_good('abc'))
+
+    def test_disabled(self) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            results = InstallResults(Path(tempdirname) / 'installs.json', 0)
+
+            # Act
+            results.record('abc')
+
+            # Assert
+            self.assertFalse(results.known_good('abc'))
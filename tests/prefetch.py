@@ -0,0 +1,99 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock, call
+
+from ckan_meta_tester.game_version import GameVersion
+from ckan_meta_tester.prefetch import Prefetcher, Download
+
+
+class TestPrefetcher(TestCase):
+
+    def test_version_key(self) -> None:
+        # Act / Assert
+        self.assertLess(Prefetcher.version_key('1.9'), Prefetcher.version_key('1.10'))
+        self.assertLess(Prefetcher.version_key('v1.10'), Prefetcher.version_key('1:0.1'))
+        self.assertLess(Prefetcher.version_key('1.0-beta'), Prefetcher.version_key('1.1'))
+
+    def test_downloads_with_dependencies(self) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            ckan = Path(tempdirname) / 'Astrogator-v1.0.ckan'
+            ckan.write_text("""{
+                "identifier": "Astrogator",
+                "version":    "v1.0",
+                "download":   "https://example.com/Astrogator.zip",
+                "download_hash": { "sha256": "ABCD" },
+                "depends": [ { "name": "ModuleManager" }, { "any_of": [ { "name": "A" }, { "name": "B" } ] } ]
+            }""")
+            registry = Path(tempdirname) / 'registry.json'
+            registry.write_text("""{ "available_modules": {
+                "ModuleManager": { "module_version": {
+                    "4.2.1": { "identifier": "ModuleManager", "version": "4.2.1",
+                               "download": [ "https://example.com/MM-4.2.1.zip", "https://mirror.example.com/MM-4.2.1.zip" ],
+                               "download_hash": { "sha1": "1234" } },
+                    "4.2.10": { "identifier": "ModuleManager", "version": "4.2.10",
+                                "download": "https://example.com/MM-4.2.10.zip" }
+                } },
+                "A": { "module_version": { "1.0": { "identifier": "A", "version": "1.0",
+                                                    "download": "https://example.com/A.zip" } } }
+            } }""")
+            cache = Mock()
+            prefetcher = Prefetcher(cache, 2)
+            game = Mock(versions=[GameVersion('1.11'), GameVersion('1.12')])
+
+            # Act
+            failures = prefetcher.prefetch([ckan], [registry], game, [])
+
+            # Assert
+            self.assertEqual(failures, 0)
+            self.assertCountEqual(cache.fetch.mock_calls, [
+                call('https://example.com/Astrogator.zip', 'Astrogator-v1.0.zip', 'ABCD', None),
+                call('https://example.com/MM-4.2.10.zip', 'ModuleManager-4.2.10.zip', None, None),
+            ])
+
+    def test_downloads_skip_metapackages(self) -> None:
+        # Act
+        downloads = Prefetcher.downloads([
+            {'identifier': 'Meta', 'version': '1', 'kind': 'metapackage'},
+            {'identifier': 'Mod', 'version': '1', 'download': ['https://a/Mod.zip', 'https://b/Mod.zip']},
+        ])
+
+        # Assert
+        self.assertListEqual(downloads, [
+            Download(['https://a/Mod.zip', 'https://b/Mod.zip'], 'Mod-1.zip', None, None),
+        ])
+
+    def test_dependencies_compatible_with_ckan(self) -> None:
+        with TemporaryDirectory() as tempdirname:
+            # Arrange
+            ckan = Path(tempdirname) / 'Astrogator-v1.0.ckan'
+            ckan.write_text("""{
+                "identifier": "Astrogator",
+                "version":    "v1.0",
+                "ksp_version_max": "1.11",
+                "download":   "https://example.com/Astrogator.zip",
+                "depends": [ { "name": "ModuleManager" } ]
+            }""")
+            registry = Path(tempdirname) / 'registry.json'
+            registry.write_text("""{ "available_modules": {
+                "ModuleManager": { "module_version": {
+                    "4.2.1": { "identifier": "ModuleManager", "version": "4.2.1",
+                               "ksp_version": "1.11",
+                               "download": "https://example.com/MM-4.2.1.zip" },
+                    "4.2.10": { "identifier": "ModuleManager", "version": "4.2.10",
+                                "ksp_version_min": "1.12",
+                                "download": "https://example.com/MM-4.2.10.zip" }
+                } }
+            } }""")
+            cache = Mock()
+            game = Mock(versions=[GameVersion('1.10'), GameVersion('1.11'), GameVersion('1.12')])
+
+            # Act
+            Prefetcher(cache, 2).prefetch([ckan], [registry], game, [])
+
+            # Assert
+            self.assertCountEqual(cache.fetch.mock_calls, [
+                call('https://example.com/Astrogator.zip', 'Astrogator-v1.0.zip', None, None),
+                call('https://example.com/MM-4.2.1.zip', 'ModuleManager-4.2.1.zip', None, None),
+            ])
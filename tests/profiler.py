@@ -0,0 +1,36 @@
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from pstats import Stats
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from ckan_meta_tester.profiler import Profiler
+from ckan_meta_tester.supervisor import ChildUsage, Supervisor, run
+
+
+class TestProfiler(TestCase):
+
+    @patch.object(Supervisor, 'usage', ChildUsage())
+    def test_profile_attributes_child_time(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            # Arrange
+            path = Path(tmpdir) / 'profile' / 'tester.pstats'
+
+            # Act
+            out = StringIO()
+            with redirect_stdout(out):
+                with Profiler(path, 5):
+                    run(['sleep', '0.2'], capture_output=True, phase='lint')
+                    sum(i * i for i in range(100000))
+
+            # Assert
+            self.assertTrue(path.exists())
+            self.assertTrue(Stats(str(path)).get_stats_profile().func_profiles)
+            self.assertEqual(Supervisor.usage.commands, {'lint': 1})
+            self.assertGreaterEqual(Supervisor.usage.wall['lint'], 0.2)
+            summary = out.getvalue()
+            self.assertIn('in child processes', summary)
+            self.assertIn('lint: 1 commands', summary)
+            self.assertIn('Top 5 functions', summary)
@@ -0,0 +1,81 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase
+
+from ckan_meta_tester.spec_validator import SpecValidator, SpecProblem
+
+
+class TestSpecValidator(TestCase):
+
+    def validate(self, filename: str, contents: str) -> List[SpecProblem]:
+        with TemporaryDirectory() as tempdirname:
+            path = Path(tempdirname) / filename
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(contents)
+            validator = SpecValidator(path)
+            # Folder checks use paths relative to the repo root
+            validator.file = Path(filename)
+            return validator.validate()
+
+    def test_valid_ckan(self) -> None:
+        # Act
+        problems = self.validate('NASA-CountDown/NASA-CountDown-1.3.9.1.ckan', """{
+            "spec_version": "v1.4",
+            "identifier":   "NASA-CountDown",
+            "name":         "NASA CountDown Clock",
+            "abstract":     "A countdown clock",
+            "version":      "1.3.9.1",
+            "ksp_version_min": "1.8",
+            "ksp_version_max": "1.10",
+            "author":       "linuxgurugamer",
+            "license":      "CC-BY-NC-SA",
+            "download":     "https://spacedock.info/mod/1462/NASA%20CountDown%20Clock%20Updated/download/1.3.9.1"
+        }""")
+
+        # Assert
+        self.assertListEqual(problems, [])
+
+    def test_invalid_ckan(self) -> None:
+        # Act
+        problems = self.validate('CountDown/NASA-CountDown-1.3.9.1.ckan', """{
+            "spec_version": "1.4",
+            "identifier":   "NASA-CountDown",
+            "version":      "1.3.9.1",
+            "ksp_version":  "1.8",
+            "ksp_version_max": "1.x",
+            "author":       "linuxgurugamer",
+            "license":      "CC-BY-NC-SA"
+        }""")
+
+        # Assert
+        self.assertListEqual(problems, [
+            SpecProblem('Required property name is missing'),
+            SpecProblem('Required property abstract is missing'),
+            SpecProblem('Required property download is missing'),
+            SpecProblem('spec_version must be 1 or look like v1.34, not 1.4', 2),
+            SpecProblem('NASA-CountDown-1.3.9.1.ckan should be in a folder named NASA-CountDown, not CountDown', 3),
+            SpecProblem('ksp_version cannot be combined with ksp_version_min or ksp_version_max', 5),
+            SpecProblem('Malformed game version: 1.x', 6),
+        ])
+
+    def test_netkan(self) -> None:
+        # Arrange
+        netkan = """
+spec_version: 1
+identifier: Astrogator
+$kref: '#/ckan/github/HebaruSan/Astrogator'
+ksp_version_min: 1.10
+"""
+
+        # Act / Assert
+        self.assertListEqual(self.validate('NetKAN/Astrogator.netkan', netkan), [])
+        self.assertListEqual(self.validate('NetKAN/Astrogater.netkan', netkan), [
+            SpecProblem('Astrogater.netkan should be named Astrogator.netkan to match its identifier', 3),
+        ])
+        # Meta-netkans in mod repos can be called anything
+        self.assertListEqual(self.validate('Astrogater.netkan', netkan), [])
+
+    def test_unparseable(self) -> None:
+        # Act / Assert
+        self.assertListEqual(self.validate('Broken.ckan', '{ "identifier": '), [])
@@ -0,0 +1,73 @@
+from time import monotonic
+from unittest import TestCase
+from unittest.mock import patch
+
+from ckan_meta_tester.supervisor import Supervisor, Timeouts, CommandTimeout, run
+
+
+class TestSupervisor(TestCase):
+
+    def test_output_and_usage(self) -> None:
+        # Act
+        with Supervisor(['sh', '-c', 'cat; printf "two\\r\\nthree"; exit 3'],
+                        input_str='one\n') as sup:
+            lines = list(sup.lines())
+            returncode = sup.wait()
+
+        # Assert
+        self.assertListEqual(lines, ['one\n', 'two\n', 'three'])
+        self.assertEqual(returncode, 3)
+        self.assertIsNone(sup.timed_out)
+        self.assertIsNotNone(sup.cpu_seconds)
+        self.assertGreater(sup.peak_rss_kb or 0, 0)
+
+    @patch.dict(Supervisor.TIMEOUTS, {'test': Timeouts(30, 0.5)})
+    def test_idle_timeout_kills_process_tree(self) -> None:
+        # Arrange
+        start = monotonic()
+
+        # Act
+        with Supervisor(['sh', '-c', 'echo started; sleep 60 & wait'], 'test') as sup:
+            lines = list(sup.lines())
+            returncode = sup.wait()
+
+        # Assert
+        self.assertListEqual(lines, ['started\n'])
+        self.assertEqual(sup.timed_out, 'printed nothing for 0.5 seconds')
+        self.assertNotEqual(returncode, 0)
+        # The backgrounded sleep would keep the pipe open if it survived
+        self.assertLess(monotonic() - start, 10)
+
+    @patch.dict(Supervisor.TIMEOUTS, {'test': Timeouts(0.5, 30)})
+    def test_wall_timeout(self) -> None:
+        # Act
+        with Supervisor(['sh', '-c', 'while true; do echo tick; sleep 0.1; done'], 'test') as sup:
+            list(sup.lines())
+            sup.wait()
+
+        # Assert
+        self.assertEqual(sup.timed_out, 'took longer than 0.5 seconds')
+
+    @patch.dict(Supervisor.TIMEOUTS)
+    def test_configure(self) -> None:
+        # Act
+        Supervisor.configure('inflate=100/10, install=/20')
+
+        # Assert
+        self.assertEqual(Supervisor.TIMEOUTS['inflate'], Timeouts(100, 10))
+        self.assertEqual(Supervisor.TIMEOUTS['install'].idle, 20)
+
+    def test_name_hides_arguments(self) -> None:
+        # Act / Assert
+        self.assertEqual(Supervisor(['mono', '/usr/local/bin/netkan.exe', '--github-token', 'secret']).name,
+                         'netkan.exe')
+
+    def test_run(self) -> None:
+        # Act / Assert
+        self.assertEqual(run(['sh', '-c', 'echo hidden; exit 2'], capture_output=True), 2)
+
+    @patch.dict(Supervisor.TIMEOUTS, {'test': Timeouts(30, 0.5)})
+    def test_run_raises_on_timeout(self) -> None:
+        # Act / Assert
+        with self.assertRaises(CommandTimeout):
+            run(['sleep', '60'], capture_output=True, check=False, phase='test')